@@ -1,26 +1,106 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
 from transformers import AutoTokenizer, AutoModelForCausalLM
 import torch
+import os
+import sys
+import threading
+
+from response_cache import ResponseCache
+
+# The request profiler is shared with the upload service; import it from the repo root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server.upload_service import profiling
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend requests
 
+# --------------------
+# Response cache
+# --------------------
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 256))
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", 3600))
+# Near-duplicate matching on mean-pooled last-layer hidden states. The model
+# is small, so treat this as a paraphrase matcher: keep the threshold high.
+CACHE_SEMANTIC = os.environ.get("CACHE_SEMANTIC", "0") == "1"
+CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("CACHE_SIMILARITY_THRESHOLD", 0.95))
+
+def embed_question(text):
+    """
+    Mean-pooled contextual (last hidden layer) embedding of the question,
+    so word order matters ("is A hotter than B" != "is B hotter than A")
+    """
+    if not model or not tokenizer or not text:
+        return None
+    ids = tokenizer.encode(text, return_tensors="pt")
+    with torch.no_grad():
+        outputs = model(ids, output_hidden_states=True)
+    return outputs.hidden_states[-1][0].mean(dim=0)
+
+response_cache = ResponseCache(
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    embed_fn=embed_question if CACHE_SEMANTIC else None,
+    similarity_threshold=CACHE_SIMILARITY_THRESHOLD
+)
+
 # --------------------
 # Load fine-tuned model
 # --------------------
 MODEL_PATH = "./fine_tuned_roki"
-print("Loading model from:", MODEL_PATH)
+tokenizer = None
+model = None
+loaded_version = None
+model_lock = threading.Lock()
 
-try:
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-    model = AutoModelForCausalLM.from_pretrained(MODEL_PATH)
-    model.eval()  # eval mode
+def model_version():
+    """
+    Fingerprint of the weight/config files under MODEL_PATH (name, size, mtime),
+    so overwriting weights in place counts as a new model
+    """
+    entries = []
+    for root, _, files in os.walk(MODEL_PATH):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            entries.append((os.path.relpath(os.path.join(root, name), MODEL_PATH), stat.st_size, stat.st_mtime_ns))
+    return hash(tuple(sorted(entries)))
+
+def load_model():
+    """
+    (Re)load the model and drop every cached answer produced by the previous one.
+    If loading fails the previous model (if any) keeps serving; the next change
+    to the files triggers another attempt
+    """
+    global tokenizer, model, loaded_version
+    version = model_version()
+    print("Loading model from:", MODEL_PATH)
+    try:
+        new_tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
+        new_model = AutoModelForCausalLM.from_pretrained(MODEL_PATH)
+        new_model.eval()  # eval mode
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        loaded_version = version
+        return
+    tokenizer, model = new_tokenizer, new_model
     print("Model loaded successfully!")
-except Exception as e:
-    print(f"Error loading model: {e}")
-    tokenizer = None
-    model = None
+    loaded_version = version
+    response_cache.set_version(version)
+
+def ensure_current_model():
+    """
+    Reload if the files under MODEL_PATH changed since the last load
+    """
+    if model_version() == loaded_version:
+        return
+    with model_lock:
+        if model_version() != loaded_version:
+            load_model()
+
+load_model()
 
 # --------------------
 # Chat function with context
@@ -29,8 +109,18 @@ def generate_answer(user_input, planet_name=None, max_length=200):
     """
     Generate an answer based on user input and optional planet context
     """
-    if not model or not tokenizer:
+    ensure_current_model()
+    # Read the cache version before the model: load_model swaps the model first,
+    # so an answer from a model replaced mid-generation is never cached as current
+    cache_version = response_cache.version
+    current_model, current_tokenizer = model, tokenizer
+    if not current_model or not current_tokenizer:
         return "Model not loaded. Please check the server logs."
+
+    # Serve repeated questions from the cache
+    cached = response_cache.get(user_input, planet_name)
+    if cached is not None:
+        return cached
     
     # Add planet context to the prompt if provided
     if planet_name:
@@ -40,14 +130,14 @@ def generate_answer(user_input, planet_name=None, max_length=200):
     
     try:
         # Encode input
-        inputs = tokenizer.encode(prompt + tokenizer.eos_token, return_tensors="pt")
+        inputs = current_tokenizer.encode(prompt + current_tokenizer.eos_token, return_tensors="pt")
         
         # Generate continuation
         with torch.no_grad():
-            outputs = model.generate(
+            outputs = current_model.generate(
                 inputs,
                 max_length=max_length,
-                pad_token_id=tokenizer.eos_token_id,
+                pad_token_id=current_tokenizer.eos_token_id,
                 do_sample=True,
                 top_k=50,
                 top_p=0.9,
@@ -56,7 +146,7 @@ def generate_answer(user_input, planet_name=None, max_length=200):
             )
         
         # Decode only the generated part (skip the prompt)
-        response = tokenizer.decode(outputs[:, inputs.shape[-1]:][0], skip_special_tokens=True)
+        response = current_tokenizer.decode(outputs[:, inputs.shape[-1]:][0], skip_special_tokens=True)
         
         # Clean up the response
         response = response.strip()
@@ -67,12 +157,68 @@ def generate_answer(user_input, planet_name=None, max_length=200):
             if last_period > 0:
                 response = response[:last_period + 1]
         
-        return response if response else "I'm not sure how to answer that. Could you rephrase your question?"
+        if not response:
+            return "I'm not sure how to answer that. Could you rephrase your question?"
+
+        response_cache.put(user_input, planet_name, response, version=cache_version)
+        return response
         
     except Exception as e:
         print(f"Error generating response: {e}")
         return "I encountered an error while processing your question. Please try again."
 
+# --------------------
+# Request profiling (opt-in)
+# --------------------
+# Hooks are only registered when PROFILING_ENABLED=1, so there is no per-request cost otherwise
+if profiling.PROFILING_ENABLED:
+    @app.before_request
+    def start_profile():
+        if profiling.should_profile(
+            request.headers.get(profiling.PROFILE_HEADER),
+            request.args.get(profiling.PROFILE_QUERY_PARAM),
+            request.headers.get(profiling.ADMIN_TOKEN_HEADER)
+        ):
+            # Each Flask request runs on one thread, so only sample that thread
+            g.profile = profiling.begin_profile(
+                request.method, request.path, thread_ids={threading.get_ident()}
+            )
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop("profile", None)
+        if profile is not None:
+            response.headers["X-Profile-Id"] = profiling.end_profile(profile, response.status_code)
+        return response
+
+    @app.teardown_request
+    def abort_profile(error=None):
+        # after_request is skipped on unhandled errors; still release the profiler
+        profile = g.pop("profile", None)
+        if profile is not None:
+            profiling.end_profile(profile, 500)
+
+@app.route("/admin/profiles", methods=["GET"])
+def list_profiles():
+    """
+    Stored request profiles (requires X-Admin-Token)
+    """
+    if not profiling.admin_authorized(request.headers.get(profiling.ADMIN_TOKEN_HEADER)):
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify({"profiles": profiling.list_profiles()})
+
+@app.route("/admin/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """
+    One stored request profile (requires X-Admin-Token)
+    """
+    if not profiling.admin_authorized(request.headers.get(profiling.ADMIN_TOKEN_HEADER)):
+        return jsonify({"error": "Forbidden"}), 403
+    result = profiling.get_profile(profile_id)
+    if result is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify(result)
+
 # --------------------
 # Flask routes
 # --------------------
@@ -131,7 +277,8 @@ def health():
         "status": "healthy",
         "model_loaded": model is not None,
         "tokenizer_loaded": tokenizer is not None,
-        "model_path": MODEL_PATH
+        "model_path": MODEL_PATH,
+        "cache": response_cache.stats()
     })
 
 if __name__ == "__main__":
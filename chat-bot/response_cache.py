@@ -0,0 +1,167 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+
+# --------------------
+# Question normalization
+# --------------------
+def normalize_question(text):
+    """
+    Lowercase, drop punctuation and collapse whitespace so that
+    "What is Kepler-442b?" and "what is kepler 442b" share a cache entry
+    """
+    text = (text or "").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def normalize_planet(planet):
+    # The API accepts any JSON value for "planet" (e.g. 42), not just strings
+    return "" if planet is None else str(planet).strip().lower()
+
+
+# --------------------
+# Response cache (TTL + LRU, optional near-duplicate match)
+# --------------------
+class ResponseCache:
+    """
+    In-memory cache for generated answers.
+
+    Entries are keyed on (normalized question, planet) and expire after
+    `ttl_seconds`; once `max_entries` is reached the least recently used
+    entry is evicted. If an `embed_fn` is given, a miss on the exact key
+    falls back to a cosine-similarity search over the cached questions for
+    the same planet, and a match above `similarity_threshold` counts as a hit.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600,
+                 embed_fn=None, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+
+        self._entries = OrderedDict()  # key -> (response, expires_at)
+        self._vectors = {}             # key -> normalized embedding
+        self._lock = threading.Lock()
+        self._version = None
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    # ----- Invalidation -----
+    def set_version(self, version):
+        """
+        Drop every entry when the model version changes (e.g. a new MODEL_PATH)
+        """
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._vectors.clear()
+                self._version = version
+
+    @property
+    def version(self):
+        return self._version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors.clear()
+
+    # ----- Lookup / store -----
+    def get(self, question, planet=None):
+        key = (normalize_question(question), normalize_planet(planet))
+        now = time.time()
+
+        with self._lock:
+            self._expire(now)
+
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+        if self.embed_fn is not None:
+            vector = self._embed(key[0])
+            if vector is not None:
+                with self._lock:
+                    match = self._nearest(vector, key[1])
+                    if match is not None and match in self._entries:
+                        self._entries.move_to_end(match)
+                        self.semantic_hits += 1
+                        return self._entries[match][0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, question, planet, response, version=None):
+        """
+        Store an answer. Pass the cache `version` read before generating it:
+        if the model was swapped in the meantime the answer is dropped
+        instead of being cached under the new model.
+        """
+        key = (normalize_question(question), normalize_planet(planet))
+        vector = self._embed(key[0]) if self.embed_fn is not None else None
+
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._entries[key] = (response, time.time() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            if vector is not None:
+                self._vectors[key] = vector
+
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._vectors.pop(old_key, None)
+
+    # ----- Stats -----
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "semantic": self.embed_fn is not None,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+    # ----- Internals (caller holds the lock) -----
+    def _expire(self, now):
+        expired = [k for k, (_, expires_at) in self._entries.items() if expires_at <= now]
+        for k in expired:
+            del self._entries[k]
+            self._vectors.pop(k, None)
+
+    def _nearest(self, vector, planet):
+        keys = [k for k in self._vectors if k[1] == planet]
+        if not keys:
+            return None
+
+        matrix = torch.stack([self._vectors[k] for k in keys])
+        scores = matrix @ vector
+        best = int(torch.argmax(scores))
+        if float(scores[best]) >= self.similarity_threshold:
+            return keys[best]
+        return None
+
+    def _embed(self, text):
+        try:
+            vector = self.embed_fn(text)
+        except Exception as e:
+            print(f"Error embedding question for cache: {e}")
+            return None
+        if vector is None:
+            return None
+        return torch.nn.functional.normalize(vector.float().flatten(), dim=0)
@@ -0,0 +1,409 @@
+"""
+Benchmark suite for the prediction, training and dataset paths.
+
+Run from the repository root:
+
+    python server/benchmarks/run_benchmarks.py --output results.json
+    python server/benchmarks/run_benchmarks.py --baseline server/benchmarks/baseline.json
+
+Uses kepler_koi_dataset.csv plus synthetic scale-ups (rows replicated with
+small numeric jitter), and writes all results as a single JSON document.
+When --baseline is given, every metric is compared against the stored run
+and regressions beyond --tolerance make the script exit non-zero.
+"""
+import argparse
+import asyncio
+import gc
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+# Add the project's root directory to the Python path
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(ROOT_DIR)
+
+from server.models.notebook.KOI import preprocess_data, build_candidate_models
+
+import joblib
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import f1_score
+
+
+DATASET_PATH = os.path.join(ROOT_DIR, "server/models/notebook/kepler_koi_dataset.csv")
+SAVED_MODEL_DIR = os.path.join(ROOT_DIR, "server/models/saved_model")
+
+DEFAULT_SCALES = "1,10,100"
+DEFAULT_TRAIN_SCALES = "1"
+DEFAULT_BATCH_SIZES = "1,10,100,1000,10000"
+
+# Metrics where a larger value is better; everything else is a time or size
+HIGHER_IS_BETTER = ("rows_per_sec", "f1")
+
+
+# ==========================================================
+# 1. Data
+# ==========================================================
+def scale_dataset(df: pd.DataFrame, factor: int, seed: int = 123) -> pd.DataFrame:
+    """
+    Replicate the dataset `factor` times. Copies after the first get unique
+    kepids and 1% gaussian jitter on float columns, so they are not dropped
+    as duplicates during preprocessing.
+    """
+    if factor <= 1:
+        return df.copy()
+
+    rng = np.random.default_rng(seed)
+    float_cols = df.select_dtypes(include=["float64"]).columns
+    stds = df[float_cols].std().fillna(0).to_numpy()
+    id_offset = int(df["kepid"].max()) + 1
+
+    copies = [df]
+    for i in range(1, factor):
+        copy = df.copy()
+        noise = rng.normal(0, 0.01, size=(len(copy), len(float_cols))) * stds
+        copy[float_cols] = copy[float_cols].to_numpy() + noise
+        copy["kepid"] = copy["kepid"] + i * id_offset
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def _proc_status_mb(field: str):
+    """A memory field (e.g. VmRSS) from /proc/self/status in MB, or None off Linux."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak RSS high-water mark (Linux >= 4.0); False where unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process in MB (since reset_peak_rss on Linux)."""
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb() -> float:
+    """Current resident set size in MB (falls back to the peak off Linux)."""
+    current = _proc_status_mb("VmRSS")
+    return current if current is not None else peak_rss_mb()
+
+
+def summarize(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "min_ms": ordered[0] * 1000,
+    }
+
+
+# ==========================================================
+# 2. Predict throughput / latency
+# ==========================================================
+def bench_predict(df: pd.DataFrame, batch_sizes: list[int], repeats: int) -> dict:
+    """
+    Time preprocess + predict per batch size. Each repeat scores a batch at a
+    different random offset across the whole (scaled) dataset, and the "all"
+    entry scores the full dataset in one call, so larger scales measure more
+    than the 1x rows again.
+    """
+    imputer = joblib.load(os.path.join(SAVED_MODEL_DIR, "imputer.pkl"))
+    scaler = joblib.load(os.path.join(SAVED_MODEL_DIR, "scaler.pkl"))
+    selector = joblib.load(os.path.join(SAVED_MODEL_DIR, "selector.pkl"))
+    model = joblib.load(os.path.join(SAVED_MODEL_DIR, "best_model.pkl"))
+
+    features = df.drop(columns=["koi_disposition"])
+    rng = np.random.default_rng(123)
+    sizes = [(str(b), b) for b in batch_sizes if b < len(features)] + [("all", len(features))]
+    results = {}
+    for label, batch_size in sizes:
+        samples = []
+        for _ in range(repeats):
+            offset = int(rng.integers(0, len(features) - batch_size + 1))
+            batch = features.iloc[offset:offset + batch_size]
+            start = time.perf_counter()
+            X, _, _, _, _ = preprocess_data(
+                batch.copy(), fit=False, imputer=imputer, scaler=scaler, selector=selector
+            )
+            model.predict(X)
+            samples.append(time.perf_counter() - start)
+
+        stats = summarize(samples)
+        stats["rows_per_sec"] = batch_size / statistics.fmean(samples)
+        results[label] = stats
+        print(f"  predict batch={label} ({batch_size} rows): p50 {stats['p50_ms']:.2f} ms, {stats['rows_per_sec']:.0f} rows/s")
+    return results
+
+
+# ==========================================================
+# 3. End-to-end endpoints via in-process ASGI client
+# ==========================================================
+async def _bench_endpoints(main, df: pd.DataFrame, workdir: str, repeats: int, include_retrain: bool) -> dict:
+    import httpx
+    from server.upload_service.model_store import ModelStore
+    from server.upload_service.sky_index import SkyIndex
+    from server.upload_service.similarity_index import SimilarityIndex
+
+    # Point every file the service writes at the scratch directory
+    dataset_path = os.path.join(workdir, "original_dataset.csv")
+    df.to_csv(dataset_path, index=False)
+    main.ORIGINAL_DATASET_PATH = dataset_path
+    main.MERGE_FOLDER = os.path.join(workdir, "merged_datasets")
+    main.RESULTS_FILE = os.path.join(workdir, "predictions_with_ids.csv")
+    # Serve (and retrain into) a copy of the saved model so the real one is never touched
+    main.SAVED_MODEL_DIR = os.path.join(workdir, "saved_model")
+    shutil.copytree(SAVED_MODEL_DIR, main.SAVED_MODEL_DIR)
+    main.model_store = ModelStore(main.SAVED_MODEL_DIR)
+    main.model_store.load()
+    # The indexes were built for the real dataset when main was imported
+    main.sky_index = SkyIndex(dataset_path)
+    main.similarity_index = SimilarityIndex(dataset_path, main.model_store)
+    os.makedirs(main.MERGE_FOLDER, exist_ok=True)
+
+    predict_csv = df.drop(columns=["koi_disposition"]).to_csv(index=False).encode()
+    upload_csv = df.head(100).to_csv(index=False).encode()
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def timed(name, make_request):
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                response = await make_request()
+                samples.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{name} returned {response.status_code}: {response.text[:200]}")
+            results[name] = summarize(samples)
+            print(f"  {name}: p50 {results[name]['p50_ms']:.1f} ms")
+
+        await timed("upload_predict", lambda: client.post(
+            "/upload",
+            data={"action": "predict"},
+            files={"file": ("bench.csv", io.BytesIO(predict_csv), "text/csv")},
+        ))
+        await timed("dataset", lambda: client.get("/dataset"))
+
+        if include_retrain:
+            # Each call appends 100 rows and retrains every candidate model
+            await timed("upload_retrain", lambda: client.post(
+                "/upload",
+                data={"action": "upload"},
+                files={"file": ("bench.csv", io.BytesIO(upload_csv), "text/csv")},
+            ))
+    return results
+
+
+def bench_endpoints(df: pd.DataFrame, repeats: int, include_retrain: bool) -> dict:
+    # Imported from the repository root so the service finds its saved model
+    from server.upload_service import main
+
+    workdir = tempfile.mkdtemp(prefix="koi-bench-")
+    try:
+        return asyncio.run(_bench_endpoints(main, df, workdir, repeats, include_retrain))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# ==========================================================
+# 4. Per-model training time and peak RSS
+# ==========================================================
+def _fit_one(csv_path: str, name: str) -> dict:
+    """
+    Runs in a fresh process. Preprocessing happens first; the peak RSS mark
+    is then reset and the baseline taken, so peak_rss_delta_mb is what
+    fitting this model adds on top of the prepared training data.
+    """
+    data = pd.read_csv(csv_path)
+    X, y, _, _, _ = preprocess_data(data, fit=True)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=123, stratify=y
+    )
+    model = build_candidate_models(X_train, svm_mode="both")[name]
+    del data, X, y
+    gc.collect()
+    reset_peak_rss()
+    rss_before = current_rss_mb()
+
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    peak = peak_rss_mb()
+
+    return {
+        "fit_seconds": fit_seconds,
+        "f1": f1_score(y_test, model.predict(X_test), average="weighted"),
+        "peak_rss_mb": peak,
+        "peak_rss_delta_mb": peak - rss_before,
+        "train_rows": len(X_train),
+    }
+
+
+def bench_training(df: pd.DataFrame) -> dict:
+    with tempfile.TemporaryDirectory(prefix="koi-bench-") as tmp:
+        csv_path = os.path.join(tmp, "train.csv")
+        df.to_csv(csv_path, index=False)
+
+        results = {}
+        # Time both the exact and the Nystroem SVM so their cost can be compared
+        for name in build_candidate_models(svm_mode="both"):
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                results[name] = pool.submit(_fit_one, csv_path, name).result()
+            r = results[name]
+            print(f"  fit {name}: {r['fit_seconds']:.2f}s, +{r['peak_rss_delta_mb']:.0f} MB peak RSS over preprocessing")
+        return results
+
+
+# ==========================================================
+# 5. Baseline comparison
+# ==========================================================
+def flatten(tree: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in tree.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list[dict]:
+    current = flatten(results["benchmarks"])
+    previous = flatten(baseline["benchmarks"])
+
+    regressions = []
+    for key, old in previous.items():
+        new = current.get(key)
+        # Absolute peak RSS includes the preprocessed data; the per-model delta is what is checked
+        if new is None or old == 0 or key.endswith(("train_rows", "peak_rss_mb")):
+            continue
+        change = (new - old) / abs(old)
+        if key.endswith(HIGHER_IS_BETTER):
+            change = -change
+        if change > tolerance:
+            regressions.append({"metric": key, "baseline": old, "current": new, "worse_by": round(change, 4)})
+    return regressions
+
+
+def environment_info() -> dict:
+    import sklearn
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+    }
+
+
+# ==========================================================
+# 6. Entry point
+# ==========================================================
+def parse_ints(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the KOI prediction, training and dataset paths.")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results.")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against.")
+    parser.add_argument("--update-baseline", action="store_true", help="Also write the results to --baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown (default 0.10).")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="Dataset scale factors for predict/endpoints.")
+    parser.add_argument("--train-scales", default=DEFAULT_TRAIN_SCALES, help="Dataset scale factors for training.")
+    parser.add_argument("--batch-sizes", default=DEFAULT_BATCH_SIZES, help="Predict batch sizes.")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed repetitions per measurement.")
+    parser.add_argument("--include-retrain", action="store_true", help="Also time /upload with action=upload.")
+    parser.add_argument("--skip", default="", help="Comma-separated sections to skip: predict,endpoints,training.")
+    args = parser.parse_args(argv)
+
+    skip = set(s.strip() for s in args.skip.split(",") if s.strip())
+    base_df = pd.read_csv(DATASET_PATH)
+    benchmarks = {"predict": {}, "endpoints": {}, "training": {}}
+
+    for factor in parse_ints(args.scales):
+        df = scale_dataset(base_df, factor)
+        label = f"{factor}x"
+        print(f"\n=== Scale {label} ({len(df)} rows) ===")
+        if "predict" not in skip:
+            benchmarks["predict"][label] = bench_predict(df, parse_ints(args.batch_sizes), args.repeats)
+        if "endpoints" not in skip:
+            benchmarks["endpoints"][label] = bench_endpoints(df, args.repeats, args.include_retrain)
+
+    if "training" not in skip:
+        for factor in parse_ints(args.train_scales):
+            label = f"{factor}x"
+            print(f"\n=== Training at scale {label} ===")
+            benchmarks["training"][label] = bench_training(scale_dataset(base_df, factor))
+
+    results = {"environment": environment_info(), "benchmarks": benchmarks}
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+
+    if not args.baseline:
+        return 0
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    if not regressions:
+        print(f"✅ No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+        return 0
+
+    print(f"⚠️ {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+    for r in regressions:
+        print(f"  {r['metric']}: {r['baseline']:.4g} -> {r['current']:.4g} (+{r['worse_by']:.1%})")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
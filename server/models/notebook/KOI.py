@@ -2,6 +2,9 @@ import pandas as pd
 import numpy as np
 import joblib
 import os
+import sys
+import time
+import json
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.impute import SimpleImputer
@@ -12,44 +15,84 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
 from sklearn.svm import SVC
 from sklearn.neighbors import KNeighborsClassifier
+from sklearn.kernel_approximation import Nystroem
+from sklearn.pipeline import make_pipeline
 from sklearn.feature_selection import SelectKBest, mutual_info_classif
 
+# Add the project's root directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+
+from server.models.notebook.tuning import tune_candidate_models, TUNING_TIME_BUDGET
+from server.models.notebook.flat_trees import flatten_tree_ensemble
+
+
+# ----- RBF SVM candidate -----
+# "exact": SVC (O(n^2)-O(n^3) fit), "approx": Nystroem features + linear model (O(n)),
+# "both": train both and compare, "auto": exact up to SVM_EXACT_MAX_ROWS training rows
+SVM_MODES = ("auto", "exact", "approx", "both")
+SVM_MODE = os.environ.get("SVM_MODE", "auto")
+SVM_EXACT_MAX_ROWS = int(os.environ.get("SVM_EXACT_MAX_ROWS", 20000))
+NYSTROEM_COMPONENTS = int(os.environ.get("NYSTROEM_COMPONENTS", 500))
+
+# ----- Hyperparameter tuning (successive halving, see tuning.py) -----
+TUNE_MODELS = os.environ.get("TUNE_MODELS", "0") == "1"
 
 # ==========================================================
 # 1. Preprocessing function (shared)
 # ==========================================================
-def preprocess_data(data_set: pd.DataFrame, fit: bool = True,
-                    imputer=None, scaler=None, selector=None):
-    """
-    Preprocess dataset: handle errors, drop unused cols, impute, scale, select features.
-    If fit=False → use provided imputer, scaler, selector instead of fitting new ones.
-    """
+ERROR_COLS = [
+    'koi_period', 'koi_time0bk', 'koi_impact',
+    'koi_duration', 'koi_depth',
+    'koi_prad', 'koi_teq', 'koi_insol',
+    'koi_steff', 'koi_slogg', 'koi_srad',
+]
+
+DROP_COLS = [
+    "kepid", "kepoi_name", "kepler_name",
+    "koi_pdisposition", "koi_score", "koi_tce_delivname",
+    "koi_period_err1","koi_period_err2","koi_time0bk_err1","koi_time0bk_err2",
+    "koi_impact_err1","koi_impact_err2","koi_depth_err1","koi_depth_err2",
+    "koi_prad_err1","koi_prad_err2","koi_teq_err1","koi_teq_err2",
+    "koi_steff_err1","koi_steff_err2","koi_slogg_err1","koi_slogg_err2",
+    "koi_srad_err1","koi_srad_err2","koi_duration_err1","koi_duration_err2",
+    "koi_insol_err1","koi_insol_err2"
+]
+
+
+def prepare_columns(data_set: pd.DataFrame) -> pd.DataFrame:
+    """Fold measurement errors into their value columns and drop unused cols."""
 
     # ----- Handle error columns -----
-    error_cols = [
-        'koi_period', 'koi_time0bk', 'koi_impact',
-        'koi_duration', 'koi_depth',
-        'koi_prad', 'koi_teq', 'koi_insol',
-        'koi_steff', 'koi_slogg', 'koi_srad',
-    ]
-    for col in error_cols:
+    for col in ERROR_COLS:
         err1 = data_set.get(col + "_err1", pd.Series(0, index=data_set.index)).fillna(0)
         err2 = data_set.get(col + "_err2", pd.Series(0, index=data_set.index)).fillna(0)
         if col in data_set.columns:
             data_set[col] = data_set[col].fillna(0) + (err1 + err2) / 2
 
     # ----- Drop unnecessary columns -----
-    drop_cols = [
-        "kepid", "kepoi_name", "kepler_name",
-        "koi_pdisposition", "koi_score", "koi_tce_delivname",
-        "koi_period_err1","koi_period_err2","koi_time0bk_err1","koi_time0bk_err2",
-        "koi_impact_err1","koi_impact_err2","koi_depth_err1","koi_depth_err2",
-        "koi_prad_err1","koi_prad_err2","koi_teq_err1","koi_teq_err2",
-        "koi_steff_err1","koi_steff_err2","koi_slogg_err1","koi_slogg_err2",
-        "koi_srad_err1","koi_srad_err2","koi_duration_err1","koi_duration_err2",
-        "koi_insol_err1","koi_insol_err2"
-    ]
-    data_set = data_set.drop(columns=drop_cols, axis=1, errors="ignore")
+    return data_set.drop(columns=DROP_COLS, axis=1, errors="ignore")
+
+
+def transform_features(data_set: pd.DataFrame, imputer, scaler, selector) -> np.ndarray:
+    """
+    Map rows into the model's selected feature space with already fitted
+    transformers. Unlike preprocess_data, rows are neither deduplicated nor
+    reordered, so the output lines up with the input row for row.
+    """
+    X = prepare_columns(data_set.copy()).drop(columns="koi_disposition", errors="ignore")
+    if hasattr(imputer, "feature_names_in_"):
+        # Missing feature columns become NaN and are filled by the imputer
+        X = X.reindex(columns=imputer.feature_names_in_)
+    return selector.transform(scaler.transform(imputer.transform(X)))
+
+
+def preprocess_data(data_set: pd.DataFrame, fit: bool = True,
+                    imputer=None, scaler=None, selector=None):
+    """
+    Preprocess dataset: handle errors, drop unused cols, impute, scale, select features.
+    If fit=False → use provided imputer, scaler, selector instead of fitting new ones.
+    """
+    data_set = prepare_columns(data_set)
 
     # ----- Encode labels -----
     if "koi_disposition" in data_set.columns:
@@ -93,7 +136,88 @@ def preprocess_data(data_set: pd.DataFrame, fit: bool = True,
 # ==========================================================
 # 2. Training
 # ==========================================================
-def train_and_save_model(csv_path: str, save_path: str = "../saved_model"):
+def save_artifact(obj, path: str):
+    """
+    Dump uncompressed (so it can be loaded with mmap_mode) to a temp file and
+    rename it into place. Processes that memory-mapped the previous file keep
+    reading the old inode instead of seeing a truncated file.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_flat_model(model, X_check, path: str) -> bool:
+    """
+    Save a flat-array copy of a tree ensemble (see flat_trees.py) so serving
+    workers can share it through memory mapping. The copy is only kept if it
+    predicts exactly like the model on X_check; otherwise, and for models
+    that are not tree ensembles, any stale copy at `path` is removed.
+    """
+    try:
+        flat = flatten_tree_ensemble(model)
+        if flat is not None and not np.array_equal(flat.predict(X_check), model.predict(X_check)):
+            print("⚠️ Warning: Flat tree export disagrees with the model; it will not be saved.")
+            flat = None
+    except Exception as e:
+        print("⚠️ Warning: Could not export flat tree arrays.", str(e))
+        flat = None
+
+    if flat is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+    save_artifact(flat, path)
+    return True
+
+
+def build_candidate_models(X_train=None, svm_mode: str = None):
+    """
+    Fresh, unfitted instances of every candidate model, keyed by name.
+    X_train (optional) decides the SVM variant in "auto" mode and sets the
+    Nystroem gamma to match SVC's gamma='scale'.
+    """
+    svm_mode = svm_mode or SVM_MODE
+    if svm_mode not in SVM_MODES:
+        raise ValueError(f"Unknown SVM mode {svm_mode!r}; expected one of {', '.join(SVM_MODES)}")
+    if svm_mode == "auto":
+        exact = X_train is None or len(X_train) <= SVM_EXACT_MAX_ROWS
+        svm_mode = "exact" if exact else "approx"
+
+    gamma = None
+    if X_train is not None and X_train.var() > 0:
+        gamma = 1.0 / (X_train.shape[1] * X_train.var())
+
+    models = {
+        "Logistic Regression": LogisticRegression(max_iter=1000, random_state=123),
+        "Random Forest": RandomForestClassifier(n_estimators=100, random_state=123),
+    }
+    if svm_mode in ("exact", "both"):
+        models["SVM"] = SVC(kernel='rbf', probability=True, random_state=123)
+    if svm_mode in ("approx", "both"):
+        models["SVM (Nystroem)"] = make_pipeline(
+            Nystroem(kernel='rbf', gamma=gamma, n_components=NYSTROEM_COMPONENTS, random_state=123),
+            LogisticRegression(max_iter=1000, random_state=123)
+        )
+    models["Gradient Boosting"] = GradientBoostingClassifier(n_estimators=100, random_state=123)
+    models["KNN"] = KNeighborsClassifier(n_neighbors=5)
+    return models
+
+
+def train_and_save_model(csv_path: str, save_path: str = "../saved_model",
+                         on_model_trained=None, tune: bool = None,
+                         time_budget: float = TUNING_TIME_BUDGET):
+    """
+    Train every candidate model, keep the best by weighted F1 and save it
+    together with the preprocessing pipeline.
+    on_model_trained, if given, is called as (name, fit_seconds, accuracy, f1)
+    after each candidate is evaluated.
+    tune (default: TUNE_MODELS) first searches each family's hyperparameters
+    with successive halving within time_budget seconds; the per-trial
+    timings and scores are saved as tuning_trials.json next to the model
+    (an untuned run removes any earlier tuning_trials.json).
+    """
+    tune = TUNE_MODELS if tune is None else tune
     data = pd.read_csv(csv_path)
 
     # Preprocess (fit=True)
@@ -103,35 +227,50 @@ def train_and_save_model(csv_path: str, save_path: str = "../saved_model"):
         X, y, test_size=0.2, random_state=123, stratify=y
     )
 
-    models = {
-        "Logistic Regression": LogisticRegression(max_iter=1000, random_state=123),
-        "Random Forest": RandomForestClassifier(n_estimators=100, random_state=123),
-        "SVM": SVC(kernel='rbf', probability=True, random_state=123),
-        "Gradient Boosting": GradientBoostingClassifier(n_estimators=100, random_state=123),
-        "KNN": KNeighborsClassifier(n_neighbors=5)
-    }
+    models = build_candidate_models(X_train)
+
+    trials = None
+    if tune:
+        models, trials = tune_candidate_models(models, X_train, y_train, time_budget=time_budget)
 
+    results = []
     best_model, best_name, best_score = None, None, 0.0
     for name, model in models.items():
         print(f"\nTraining {name}...")
+        start = time.perf_counter()
         model.fit(X_train, y_train)
+        fit_seconds = time.perf_counter() - start
         preds = model.predict(X_test)
 
         f1 = f1_score(y_test, preds, average="weighted")
         acc = accuracy_score(y_test, preds)
-        print(f" -> Accuracy {acc:.4f}, F1 {f1:.4f}")
+        print(f" -> Accuracy {acc:.4f}, F1 {f1:.4f} ({fit_seconds:.2f}s)")
+        results.append((name, acc, f1, fit_seconds))
+        if on_model_trained is not None:
+            on_model_trained(name, fit_seconds, acc, f1)
 
         if f1 > best_score:
             best_model, best_name, best_score = model, name, f1
 
+    print(f"\n{'Model':<22}{'Accuracy':>10}{'F1':>10}{'Fit (s)':>10}")
+    for name, acc, f1, fit_seconds in results:
+        print(f"{name:<22}{acc:>10.4f}{f1:>10.4f}{fit_seconds:>10.2f}")
     print(f"\n✅ Best model: {best_name} with F1 = {best_score:.4f}")
 
     # Save preprocessing pipeline + model
     os.makedirs(save_path, exist_ok=True)
-    joblib.dump(best_model, os.path.join(save_path, "best_model.pkl"))
-    joblib.dump(imputer, os.path.join(save_path, "imputer.pkl"))
-    joblib.dump(scaler, os.path.join(save_path, "scaler.pkl"))
-    joblib.dump(selector, os.path.join(save_path, "selector.pkl"))
+    save_artifact(best_model, os.path.join(save_path, "best_model.pkl"))
+    save_flat_model(best_model, X_test, os.path.join(save_path, "best_model_flat.pkl"))
+    save_artifact(imputer, os.path.join(save_path, "imputer.pkl"))
+    save_artifact(scaler, os.path.join(save_path, "scaler.pkl"))
+    save_artifact(selector, os.path.join(save_path, "selector.pkl"))
+    trials_path = os.path.join(save_path, "tuning_trials.json")
+    if trials is not None:
+        with open(trials_path, "w") as f:
+            json.dump(trials, f, indent=2)
+    elif os.path.exists(trials_path):
+        # Trials from an earlier tuned run do not describe this model
+        os.remove(trials_path)
 
     return best_model, best_name, best_score
 
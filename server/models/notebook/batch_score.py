@@ -0,0 +1,315 @@
+"""
+Out-of-core batch scoring for large KOI exports.
+
+    python server/models/notebook/batch_score.py survey.csv predictions.csv
+    python server/models/notebook/batch_score.py survey.csv predictions/ --format parquet --workers 8
+    python server/models/notebook/batch_score.py survey.csv predictions.csv --resume
+
+Reads the input in chunks, scores them across a process pool and writes
+results as they complete, so memory stays flat regardless of input size.
+A checkpoint next to the output records finished chunks; --resume skips
+them after an interruption, provided the input file and --chunksize are
+unchanged. Parquet output needs pyarrow or fastparquet. When koi_disposition is present, streaming
+accuracy and weighted F1 are reported.
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+
+import joblib
+import numpy as np
+import pandas as pd
+
+# Add the project's root directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+
+from server.models.notebook.KOI import transform_features
+
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "saved_model")
+
+LABEL_MAP = {"CONFIRMED": 1, "FALSE POSITIVE": 0, "CANDIDATE": 2}
+REVERSE_MAP = {v: k for k, v in LABEL_MAP.items()}
+N_CLASSES = len(LABEL_MAP)
+
+
+# ==========================================================
+# 1. Worker side
+# ==========================================================
+_artifacts = None
+
+
+def _load_artifacts(model_path: str):
+    """Load the model and transformers into this process's globals."""
+    global _artifacts
+    _artifacts = tuple(
+        joblib.load(os.path.join(model_path, name))
+        for name in ("best_model.pkl", "imputer.pkl", "scaler.pkl", "selector.pkl")
+    )
+
+
+def _make_pool(model_path: str, workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool whose workers share one loaded model. The artifacts are
+    loaded once here and forked workers inherit them copy-on-write; the
+    model's arrays are only read, so their pages are never duplicated.
+    Where fork is unavailable (Windows) each worker loads its own copy.
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        _load_artifacts(model_path)
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+    return ProcessPoolExecutor(max_workers=workers, initializer=_load_artifacts, initargs=(model_path,))
+
+
+def _score_chunk(chunk: pd.DataFrame):
+    model, imputer, scaler, selector = _artifacts
+    X = transform_features(chunk, imputer, scaler, selector)
+    preds = model.predict(X)
+
+    out = pd.DataFrame({"predicted_label": [REVERSE_MAP.get(p, "UNKNOWN") for p in preds]})
+    if "kepid" in chunk.columns:
+        out.insert(0, "kepid", chunk["kepid"].to_numpy())
+
+    confusion = None
+    if "koi_disposition" in chunk.columns:
+        truth = chunk["koi_disposition"].map(LABEL_MAP).to_numpy()
+        known = ~pd.isna(truth)
+        confusion = np.zeros((N_CLASSES, N_CLASSES), dtype=np.int64)
+        np.add.at(confusion, (truth[known].astype(int), np.asarray(preds)[known].astype(int)), 1)
+    return out, confusion
+
+
+# ==========================================================
+# 2. Streaming metrics
+# ==========================================================
+def metrics_from_confusion(confusion: np.ndarray) -> dict:
+    """Accuracy and support-weighted F1 from a (true, predicted) confusion matrix."""
+    total = confusion.sum()
+    if total == 0:
+        return {"labelled_rows": 0, "accuracy": None, "f1_weighted": None}
+
+    tp = np.diag(confusion)
+    support = confusion.sum(axis=1)
+    fp = confusion.sum(axis=0) - tp
+    fn = support - tp
+    denom = 2 * tp + fp + fn
+    f1 = np.divide(2 * tp, denom, out=np.zeros(N_CLASSES), where=denom > 0)
+    return {
+        "labelled_rows": int(total),
+        "accuracy": float(tp.sum() / total),
+        "f1_weighted": float((f1 * support).sum() / support.sum()),
+    }
+
+
+# ==========================================================
+# 3. Output + checkpoint
+# ==========================================================
+class Checkpoint:
+    """
+    Progress record stored next to the output; rewritten atomically after every chunk.
+
+    `run` identifies what the chunk indices refer to (input file and chunksize).
+    A checkpoint written for a different run cannot be resumed.
+    """
+
+    def __init__(self, output_path: str, run: dict):
+        self.path = output_path.rstrip("/\\") + ".progress.json"
+        self.run = run
+        self.chunks_done = 0
+        self.rows_done = 0
+        self.output_bytes = 0
+        self.confusion = np.zeros((N_CLASSES, N_CLASSES), dtype=np.int64)
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get("run") != self.run:
+            raise ValueError(
+                f"Checkpoint {self.path} was written for {state.get('run')}, not {self.run}. "
+                "Rerun without --resume to start over."
+            )
+        self.chunks_done = state["chunks_done"]
+        self.rows_done = state["rows_done"]
+        self.output_bytes = state["output_bytes"]
+        self.confusion = np.array(state["confusion"], dtype=np.int64)
+        return True
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "run": self.run,
+                "chunks_done": self.chunks_done,
+                "rows_done": self.rows_done,
+                "output_bytes": self.output_bytes,
+                "confusion": self.confusion.tolist(),
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """Forget earlier progress; called before a fresh run touches the output."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class CsvOutput:
+    def __init__(self, path: str, checkpoint: Checkpoint, resume: bool):
+        self.path = path
+        if resume:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < checkpoint.output_bytes:
+                raise ValueError(
+                    f"{path} has {size} bytes but the checkpoint recorded {checkpoint.output_bytes}. "
+                    "Rerun without --resume to start over."
+                )
+            # Drop anything written after the last checkpoint (a partially written chunk)
+            with open(path, "r+b") as f:
+                f.truncate(checkpoint.output_bytes)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def write(self, index: int, df: pd.DataFrame) -> int:
+        header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        df.to_csv(self.path, mode="a", header=header, index=False)
+        return os.path.getsize(self.path)
+
+
+class ParquetOutput:
+    """One part file per chunk, so a resumed run only rewrites unfinished parts."""
+
+    def __init__(self, path: str, checkpoint: Checkpoint, resume: bool):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        if resume:
+            missing = [i for i in range(checkpoint.chunks_done) if not os.path.exists(self._part(i))]
+            if missing:
+                raise ValueError(
+                    f"{path} is missing {len(missing)} part files the checkpoint recorded "
+                    f"(first: {os.path.basename(self._part(missing[0]))}). Rerun without --resume to start over."
+                )
+        else:
+            for name in os.listdir(path):
+                if name.startswith("part-") and name.endswith(".parquet"):
+                    os.remove(os.path.join(path, name))
+
+    def _part(self, index: int) -> str:
+        return os.path.join(self.path, f"part-{index:06d}.parquet")
+
+    def write(self, index: int, df: pd.DataFrame) -> int:
+        part = self._part(index)
+        df.to_parquet(part + ".tmp", index=False)
+        os.replace(part + ".tmp", part)
+        return 0
+
+
+# ==========================================================
+# 4. Driver
+# ==========================================================
+def batch_score(
+    csv_path: str,
+    output_path: str,
+    model_path: str = DEFAULT_MODEL_PATH,
+    chunksize: int = 50_000,
+    workers: int = None,
+    output_format: str = "csv",
+    resume: bool = False,
+):
+    if output_format == "parquet" and not any(
+        importlib.util.find_spec(engine) for engine in ("pyarrow", "fastparquet")
+    ):
+        raise ValueError("Parquet output needs pyarrow or fastparquet: pip install pyarrow")
+
+    workers = workers or os.cpu_count() or 1
+    stat = os.stat(csv_path)
+    run = {
+        "input": os.path.abspath(csv_path),
+        "input_size": stat.st_size,
+        "input_mtime_ns": stat.st_mtime_ns,
+        "chunksize": chunksize,
+        "format": output_format,
+    }
+    checkpoint = Checkpoint(output_path, run)
+    if resume and checkpoint.load():
+        print(f"Resuming after {checkpoint.chunks_done} chunks ({checkpoint.rows_done} rows).")
+    else:
+        resume = False
+        # Remove it before the output, so an interrupted fresh run cannot be resumed from it
+        checkpoint.clear()
+
+    output_cls = ParquetOutput if output_format == "parquet" else CsvOutput
+    output = output_cls(output_path, checkpoint, resume)
+
+    start = time.perf_counter()
+    rows_this_run = 0
+    # At most 2 chunks per worker are in flight, which keeps memory flat
+    max_pending = workers * 2
+    pending = deque()
+
+    def drain_one():
+        nonlocal rows_this_run
+        index, future = pending.popleft()
+        out, confusion = future.result()
+        checkpoint.output_bytes = output.write(index, out)
+        checkpoint.chunks_done = index + 1
+        checkpoint.rows_done += len(out)
+        if confusion is not None:
+            checkpoint.confusion += confusion
+        checkpoint.save()
+
+        rows_this_run += len(out)
+        elapsed = time.perf_counter() - start
+        print(f"  chunk {index}: {checkpoint.rows_done} rows scored, {rows_this_run / elapsed:,.0f} rows/sec")
+
+    with _make_pool(model_path, workers) as pool:
+        for index, chunk in enumerate(pd.read_csv(csv_path, chunksize=chunksize)):
+            if index < checkpoint.chunks_done:
+                continue
+            pending.append((index, pool.submit(_score_chunk, chunk)))
+            if len(pending) >= max_pending:
+                drain_one()
+        while pending:
+            drain_one()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "rows_scored": checkpoint.rows_done,
+        "seconds": round(elapsed, 2),
+        "rows_per_sec": round(rows_this_run / elapsed, 1) if elapsed > 0 else None,
+        **metrics_from_confusion(checkpoint.confusion),
+    }
+    print(f"✅ Predictions saved to {output_path}")
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a large KOI CSV in parallel, chunk by chunk.")
+    parser.add_argument("csv_path", help="Input CSV (EXPECTED_SCHEMA columns; koi_disposition optional).")
+    parser.add_argument("output_path", help="Output CSV file, or directory of part files for parquet.")
+    parser.add_argument("--model-path", default=DEFAULT_MODEL_PATH, help="Directory with the saved model artifacts.")
+    parser.add_argument("--chunksize", type=int, default=50_000, help="Rows per chunk.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores).")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", dest="output_format")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last checkpoint.")
+    args = parser.parse_args(argv)
+
+    batch_score(
+        args.csv_path, args.output_path,
+        model_path=args.model_path,
+        chunksize=args.chunksize,
+        workers=args.workers,
+        output_format=args.output_format,
+        resume=args.resume,
+    )
+
+
+if __name__ == "__main__":
+    main()
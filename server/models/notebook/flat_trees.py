@@ -0,0 +1,145 @@
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+
+
+# Rows traversed per block in predict; bounds the (rows x trees) index arrays
+PREDICT_BLOCK_ROWS = 1024
+
+
+# ==========================================================
+# 1. Flat tree ensemble
+# ==========================================================
+class FlatTreeEnsemble:
+    """
+    A fitted Random Forest or Gradient Boosting classifier stored as plain
+    numpy arrays: every tree's nodes are concatenated into one set of arrays.
+
+    sklearn's tree objects copy their nodes into private memory when they are
+    unpickled, so memory-mapping best_model.pkl shares nothing between worker
+    processes. These arrays are memory-mapped as they are by
+    joblib.load(mmap_mode="r"), so every worker reads the same page-cache
+    pages.
+
+    raw scores = offset + scale * (sum of each tree's leaf value row)
+      forest: offset 0, scale 1/n_trees, leaf rows are class probabilities
+      GBM:    offset = initial raw prediction, scale = learning_rate, each
+              tree's leaf value sits in the column of the class it fits
+    """
+
+    def __init__(self, kind, classes, roots, children_left, children_right,
+                 feature, threshold, value, offset, scale, max_depth):
+        self.kind = kind
+        self.classes_ = classes
+        self.roots = roots
+        self.children_left = children_left
+        self.children_right = children_right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.offset = offset
+        self.scale = scale
+        self.max_depth = max_depth
+
+    def _leaves(self, X: np.ndarray) -> np.ndarray:
+        """Leaf node index of every (row, tree) pair."""
+        nodes = np.tile(self.roots, (len(X), 1))
+        rows = np.arange(len(X))[:, None]
+        for _ in range(self.max_depth):
+            left = self.children_left[nodes]
+            internal = left != -1
+            if not internal.any():
+                break
+            # sklearn compares float32 feature values against float64 thresholds
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(internal, np.where(go_left, left, self.children_right[nodes]), nodes)
+        return nodes
+
+    def decision_function(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        raw = np.empty((len(X), self.value.shape[1]))
+        for start in range(0, len(X), PREDICT_BLOCK_ROWS):
+            block = X[start:start + PREDICT_BLOCK_ROWS]
+            raw[start:start + len(block)] = self.offset + self.scale * self.value[self._leaves(block)].sum(axis=1)
+        return raw
+
+    def predict_proba(self, X) -> np.ndarray:
+        raw = self.decision_function(X)
+        if self.kind == "forest":
+            return raw
+        if raw.shape[1] == 1:
+            positive = 1.0 / (1.0 + np.exp(-raw[:, 0]))
+            return np.column_stack([1.0 - positive, positive])
+        exp = np.exp(raw - raw.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict(self, X) -> np.ndarray:
+        raw = self.decision_function(X)
+        if raw.shape[1] == 1:
+            return self.classes_[(raw[:, 0] > 0).astype(int)]
+        return self.classes_[raw.argmax(axis=1)]
+
+
+# ==========================================================
+# 2. Export
+# ==========================================================
+def _concat_trees(trees, leaf_values):
+    """Concatenate sklearn Tree objects, shifting child indices to global positions."""
+    roots, left, right, feature, threshold = [], [], [], [], []
+    base = 0
+    for tree in trees:
+        is_leaf = tree.children_left == -1
+        roots.append(base)
+        left.append(np.where(is_leaf, -1, tree.children_left + base))
+        right.append(np.where(is_leaf, -1, tree.children_right + base))
+        # Leaves carry feature -2; 0 keeps the (masked out) lookup in bounds
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        base += tree.node_count
+    return (
+        np.asarray(roots, dtype=np.int64),
+        np.concatenate(left).astype(np.int64),
+        np.concatenate(right).astype(np.int64),
+        np.concatenate(feature).astype(np.int64),
+        np.concatenate(threshold).astype(np.float64),
+        np.concatenate(leaf_values).astype(np.float64),
+        max(tree.max_depth for tree in trees),
+    )
+
+
+def flatten_tree_ensemble(model):
+    """
+    FlatTreeEnsemble equivalent of a fitted RandomForestClassifier or
+    GradientBoostingClassifier, or None for any other model (or a GBM with a
+    custom init estimator, whose initial prediction depends on the row).
+    """
+    if isinstance(model, RandomForestClassifier):
+        trees = [est.tree_ for est in model.estimators_]
+        # Normalise leaf class counts to probabilities, as predict_proba does per tree
+        values = []
+        for tree in trees:
+            counts = tree.value[:, 0, :]
+            totals = counts.sum(axis=1, keepdims=True)
+            values.append(np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0))
+        roots, left, right, feature, threshold, value, depth = _concat_trees(trees, values)
+        return FlatTreeEnsemble("forest", model.classes_, roots, left, right, feature, threshold,
+                                value, np.zeros(value.shape[1]), 1.0 / len(trees), depth)
+
+    if isinstance(model, GradientBoostingClassifier):
+        if model.init not in (None, "zero"):
+            return None
+        n_stages, n_columns = model.estimators_.shape
+        trees, values = [], []
+        for stage in range(n_stages):
+            for k in range(n_columns):
+                tree = model.estimators_[stage, k].tree_
+                column = np.zeros((tree.node_count, n_columns))
+                column[:, k] = tree.value[:, 0, 0]
+                trees.append(tree)
+                values.append(column)
+        roots, left, right, feature, threshold, value, depth = _concat_trees(trees, values)
+        # The default (prior) and "zero" inits give the same raw prediction for every row
+        offset = np.asarray(model._raw_predict_init(np.zeros((1, model.n_features_in_)))[0], dtype=np.float64)
+        return FlatTreeEnsemble("gbm", model.classes_, roots, left, right, feature, threshold,
+                                value, offset, model.learning_rate, depth)
+
+    return None
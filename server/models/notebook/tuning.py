@@ -0,0 +1,182 @@
+import os
+import time
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from scipy.stats import loguniform
+from sklearn.base import clone
+from sklearn.metrics import f1_score
+from sklearn.model_selection import ParameterSampler, train_test_split
+
+
+# ----- Settings -----
+TUNING_TIME_BUDGET = float(os.environ.get("TUNING_TIME_BUDGET", 300))  # seconds for all families
+TUNING_N_CONFIGS = int(os.environ.get("TUNING_N_CONFIGS", 27))
+TUNING_ETA = int(os.environ.get("TUNING_ETA", 3))
+TUNING_MIN_ROWS = int(os.environ.get("TUNING_MIN_ROWS", 200))
+TUNING_N_JOBS = int(os.environ.get("TUNING_N_JOBS", -1))
+
+
+# ==========================================================
+# 1. Search spaces (keys match build_candidate_models)
+# ==========================================================
+PARAM_SPACES = {
+    "Logistic Regression": {
+        "C": loguniform(1e-3, 1e2),
+    },
+    "Random Forest": {
+        "n_estimators": [50, 100, 200, 400],
+        "max_depth": [None, 8, 16, 32],
+        "min_samples_leaf": [1, 2, 4],
+        "max_features": ["sqrt", "log2", None],
+    },
+    "SVM": {
+        "C": loguniform(1e-1, 1e2),
+        "gamma": ["scale", 0.01, 0.1, 1.0],
+    },
+    "SVM (Nystroem)": {
+        "nystroem__gamma": loguniform(1e-2, 1e1),
+        "logisticregression__C": loguniform(1e-2, 1e2),
+    },
+    "Gradient Boosting": {
+        "n_estimators": [50, 100, 200],
+        "learning_rate": loguniform(1e-2, 3e-1),
+        "max_depth": [2, 3, 4, 5],
+        "subsample": [0.7, 0.85, 1.0],
+    },
+    "KNN": {
+        "n_neighbors": [3, 5, 7, 11, 15, 21, 31],
+        "weights": ["uniform", "distance"],
+        "p": [1, 2],
+    },
+}
+
+
+# ==========================================================
+# 2. Successive halving
+# ==========================================================
+def _run_trial(model, params, X, y, X_val, y_val):
+    model = clone(model).set_params(**params)
+    start = time.perf_counter()
+    model.fit(X, y)
+    fit_seconds = time.perf_counter() - start
+    f1 = f1_score(y_val, model.predict(X_val), average="weighted")
+    return f1, fit_seconds
+
+
+def _subsample(X, y, n_rows, seed):
+    if n_rows >= len(X):
+        return X, y
+    X_sub, _, y_sub, _ = train_test_split(X, y, train_size=n_rows, random_state=seed, stratify=y)
+    return X_sub, y_sub
+
+
+def successive_halving(name, model, X_train, y_train, deadline: float,
+                       n_configs: int = TUNING_N_CONFIGS, eta: int = TUNING_ETA,
+                       min_rows: int = TUNING_MIN_ROWS, n_jobs: int = TUNING_N_JOBS,
+                       on_trial=None):
+    """
+    Search one model family: sample n_configs parameter sets, score them on a
+    small stratified subset, keep the best 1/eta and grow the subset by eta,
+    until one config remains or the subset is the full training data.
+
+    Each rung runs its configs in parallel batches of one trial per worker.
+    Before every batch its wall time is estimated from the previous batch
+    (scaled by the growth in rows when a new rung starts); if it would end
+    after `deadline` (time.monotonic()) the search stops and the best config
+    of the last (possibly partial) rung is returned. Only the very first
+    batch, which fits the smallest subset, has no estimate.
+    Returns (best_params, trials).
+    """
+    space = PARAM_SPACES.get(name)
+    if not space:
+        return {}, []
+
+    X_fit, X_val, y_fit, y_val = train_test_split(
+        X_train, np.asarray(y_train), test_size=0.2, random_state=123, stratify=y_train
+    )
+    configs = list(ParameterSampler(space, n_iter=n_configs, random_state=123))
+
+    n_rungs = max(1, int(np.ceil(np.log(len(configs)) / np.log(eta))) + 1)
+    n_rows = max(min_rows, len(X_fit) // eta ** (n_rungs - 1))
+
+    n_workers = max(1, effective_n_jobs(n_jobs))
+    trials = []
+    best_params = {}
+    rung = 0
+    previous = None  # (wall seconds, rows) of the last batch
+    out_of_time = False
+    while configs and not out_of_time:
+        X_sub, y_sub = _subsample(X_fit, y_fit, n_rows, seed=rung)
+
+        # Configs are in rank order, so a rung cut short has scored the most promising ones
+        scored = []
+        for i in range(0, len(configs), n_workers):
+            batch = configs[i:i + n_workers]
+            now = time.monotonic()
+            estimate = 0.0 if previous is None else previous[0] * len(X_sub) / previous[1]
+            if now >= deadline or now + estimate > deadline:
+                print(f"  {name}: next batch would take ~{estimate:.0f}s and overrun the budget; stopping.")
+                out_of_time = True
+                break
+
+            batch_start = time.monotonic()
+            scores = Parallel(n_jobs=n_jobs)(
+                delayed(_run_trial)(model, params, X_sub, y_sub, X_val, y_val) for params in batch
+            )
+            previous = (time.monotonic() - batch_start, len(X_sub))
+
+            for params, (f1, fit_seconds) in zip(batch, scores):
+                trial = {
+                    "family": name, "rung": rung, "rows": len(X_sub),
+                    "params": {k: (v if isinstance(v, (str, int, float, type(None))) else float(v)) for k, v in params.items()},
+                    "f1": float(f1), "fit_seconds": round(fit_seconds, 4),
+                }
+                trials.append(trial)
+                if on_trial is not None:
+                    on_trial(trial)
+                scored.append((params, f1))
+
+        if not scored:
+            break
+        ranked = sorted(scored, key=lambda item: item[1], reverse=True)
+        # Prefer results from the largest subset reached so far
+        best_params, best_f1 = ranked[0]
+        print(f"  {name} rung {rung}: {len(scored)}/{len(configs)} configs on {len(X_sub)} rows, best F1 {best_f1:.4f}")
+
+        if out_of_time or len(configs) == 1 or len(X_sub) >= len(X_fit):
+            break
+        configs = [params for params, _ in ranked[:max(1, len(configs) // eta)]]
+        n_rows *= eta
+        rung += 1
+
+    return best_params, trials
+
+
+def tune_candidate_models(models: dict, X_train, y_train,
+                          time_budget: float = TUNING_TIME_BUDGET, on_trial=None):
+    """
+    Run successive halving for every family within a shared wall-clock budget.
+    Each family has an equal share of time_budget reserved for it, ending at
+    start + (i + 1) * share, so time a family leaves unused rolls forward and
+    the last family ends with the budget. A family whose slot has already
+    passed keeps its default parameters.
+    Returns ({name: tuned unfitted model}, trials).
+    """
+    tuned, all_trials = {}, []
+    names = list(models)
+    share = time_budget / max(1, len(names))
+    start = time.monotonic()
+    for i, name in enumerate(names):
+        deadline = start + (i + 1) * share
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"  Tuning budget exhausted; {name} keeps default parameters.")
+            tuned[name] = models[name]
+            continue
+
+        print(f"\nTuning {name} ({remaining:.0f}s budget)...")
+        params, trials = successive_halving(name, models[name], X_train, y_train, deadline, on_trial=on_trial)
+        tuned[name] = clone(models[name]).set_params(**params)
+        all_trials.extend(trials)
+    return tuned, all_trials
@@ -1,9 +1,10 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Query
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi import Request
 from fastapi.staticfiles import StaticFiles
 import pandas as pd
-import io, os, joblib
+import io, os
 import re, smtplib, ssl, random, string, time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -22,6 +23,15 @@ logging.basicConfig(
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
 from server.models.notebook.KOI import train_and_save_model
+from server.upload_service.metrics import (
+    REQUEST_LATENCY, REQUESTS_TOTAL, ROWS, PAYLOAD_BYTES,
+    stage, record_model_fit, render_prometheus, start_flusher
+)
+from server.upload_service import profiling
+from server.upload_service.model_store import ModelStore
+from server.upload_service.sky_index import SkyIndex
+from server.upload_service.similarity_index import SimilarityIndex
+from pydantic import BaseModel, Field
 
 app = FastAPI()
 # Mount the uploading folder as static
@@ -35,6 +45,75 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ======== METRICS ========
+# Each worker writes its series to METRICS_MULTIPROC_DIR (if set) for /metrics to aggregate
+start_flusher()
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = "500"
+    response = None
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        # Use the route template (e.g. /get_result/{kepid}) to keep label cardinality bounded
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        REQUEST_LATENCY.observe(time.perf_counter() - start, request.method, endpoint, status)
+        REQUESTS_TOTAL.inc(request.method, endpoint, status)
+        if response is not None and "content-length" in response.headers:
+            PAYLOAD_BYTES.observe(int(response.headers["content-length"]), endpoint, "response")
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+# ======== PROFILING ========
+# The metrics flusher thread sleeps between writes; keep it out of profiles
+profiling.add_idle_frame("metrics.py", "_flush_loop")
+
+# Only registered when PROFILING_ENABLED=1, so there is no per-request cost otherwise
+if profiling.PROFILING_ENABLED:
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        if not profiling.should_profile(
+            request.headers.get(profiling.PROFILE_HEADER),
+            request.query_params.get(profiling.PROFILE_QUERY_PARAM),
+            request.headers.get(profiling.ADMIN_TOKEN_HEADER),
+        ):
+            return await call_next(request)
+
+        profile = profiling.begin_profile(request.method, request.url.path)
+        if profile is None:
+            return await call_next(request)
+
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            profile_id = profiling.end_profile(profile, status)
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+
+@app.get("/admin/profiles")
+def list_profiles(x_admin_token: str = Header(default=None)):
+    if not profiling.admin_authorized(x_admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return {"profiles": profiling.list_profiles()}
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(profile_id: str, x_admin_token: str = Header(default=None)):
+    if not profiling.admin_authorized(x_admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    result = profiling.get_profile(profile_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return result
+
 # =============================
 # ========== OTP PART ==========
 # =============================
@@ -140,10 +219,7 @@ PREDICTION_FOLDER = "server/models/prediction_inputs"
 RESULTS_FILE = f"{PREDICTION_FOLDER}/predictions_with_ids.csv"
 
 
-MODEL_PATH = "server/models/saved_model/best_model.pkl"
-IMPUTER_PATH = "server/models/saved_model/imputer.pkl"
-SCALER_PATH = "server/models/saved_model/scaler.pkl"
-SELECTOR_PATH = "server/models/saved_model/selector.pkl"
+SAVED_MODEL_DIR = "server/models/saved_model"
 
 os.makedirs(MERGE_FOLDER, exist_ok=True)
 os.makedirs(PREDICTION_FOLDER, exist_ok=True)
@@ -152,15 +228,10 @@ os.makedirs(PREDICTION_FOLDER, exist_ok=True)
 # =============================
 # Load Trained Model + Preprocessing
 # =============================
-try:
-    model = joblib.load(MODEL_PATH)
-    imputer = joblib.load(IMPUTER_PATH)
-    scaler = joblib.load(SCALER_PATH)
-    selector = joblib.load(SELECTOR_PATH)
-    print("✅ Loaded trained model and preprocessing objects.")
-except Exception as e:
-    print("⚠️ Warning: Could not load model or preprocessing files.", str(e))
-    model, imputer, scaler, selector = None, None, None, None
+# Memory-mapped, so uvicorn workers share the model arrays; every worker
+# reloads when a new model is promoted
+model_store = ModelStore(SAVED_MODEL_DIR)
+model_store.load()
 
 # =============================
 # Expected Schema
@@ -256,98 +327,142 @@ async def upload_file(
     if not file.filename.lower().endswith(".csv"):
         return JSONResponse(status_code=400, content={"status": "error", "message": "Only CSV files are allowed."})
 
-    content = await file.read()
-    try:
-        df = pd.read_csv(io.BytesIO(content))
-    except Exception as e:
-        return JSONResponse(status_code=400, content={"status": "error", "message": f"Invalid CSV file: {str(e)}"})
+    with stage("/upload", "parse"):
+        content = await file.read()
+        PAYLOAD_BYTES.observe(len(content), "/upload", "request")
+        try:
+            df = pd.read_csv(io.BytesIO(content))
+        except Exception as e:
+            return JSONResponse(status_code=400, content={"status": "error", "message": f"Invalid CSV file: {str(e)}"})
+    ROWS.observe(len(df), "/upload", "uploaded")
 
     # Reload original dataset from disk every time
-    try:
-        original_df = pd.read_csv(ORIGINAL_DATASET_PATH)
-    except FileNotFoundError:
-        original_df = pd.DataFrame()
+    with stage("/upload", "load_original"):
+        try:
+            original_df = pd.read_csv(ORIGINAL_DATASET_PATH)
+        except FileNotFoundError:
+            original_df = pd.DataFrame()
 
     # ========== Upload ==========
     if action == "upload":
-        valid, msg = validate_schema(df, check_target=True)
+        with stage("/upload", "validate"):
+            valid, msg = validate_schema(df, check_target=True)
         if not valid:
             return JSONResponse(status_code=400, content={"status": "error", "message": msg})
 
-        merged = pd.concat([original_df, df], ignore_index=True)
-        merged_path = os.path.join(MERGE_FOLDER, "merged.csv")
-        merged.to_csv(merged_path, index=False)
-        # Overwrite the original dataset file
-        merged.to_csv(ORIGINAL_DATASET_PATH, index=False)
+        with stage("/upload", "merge"):
+            merged = pd.concat([original_df, df], ignore_index=True)
+        ROWS.observe(len(merged), "/upload", "merged")
+
+        with stage("/upload", "persist"):
+            merged_path = os.path.join(MERGE_FOLDER, "merged.csv")
+            merged.to_csv(merged_path, index=False)
+            # Overwrite the original dataset file
+            merged.to_csv(ORIGINAL_DATASET_PATH, index=False)
 
         # Retrain model after upload
-        try:
-            best_model, best_name, best_score = train_and_save_model(merged_path, save_path="../models/saved_model")
-            return JSONResponse(status_code=200, content={
-                "status": "success",
-                "message": f"File uploaded, merged, and model retrained. Best model: {best_name} (F1={best_score:.4f})",
-                "rows_uploaded": len(df),
-                "rows_total_after_merge": len(merged),
+        candidates = []
+
+        def on_model_trained(name, fit_seconds, accuracy, f1):
+            record_model_fit(name, fit_seconds, accuracy, f1)
+            candidates.append({
+                "model": name,
+                "accuracy": round(accuracy, 4),
+                "f1": round(f1, 4),
+                "fit_seconds": round(fit_seconds, 2),
             })
+
+        try:
+            with stage("/upload", "train"):
+                best_model, best_name, best_score = train_and_save_model(
+                    merged_path, save_path=SAVED_MODEL_DIR, on_model_trained=on_model_trained
+                )
+                model_store.promote()
         except Exception as e:
             return JSONResponse(status_code=500, content={
                 "status": "error",
                 "message": f"Upload merged but failed to train model: {str(e)}"
             })
 
+        # Rebuild the similarity index now rather than on the next query.
+        # Failing here does not undo the upload; the next query retries.
+        try:
+            with stage("/upload", "reindex"):
+                similarity_index.refresh()
+        except Exception as e:
+            print("⚠️ Warning: Could not rebuild similarity index.", str(e))
+
+        return JSONResponse(status_code=200, content={
+            "status": "success",
+            "message": f"File uploaded, merged, and model retrained. Best model: {best_name} (F1={best_score:.4f})",
+            "rows_uploaded": len(df),
+            "rows_total_after_merge": len(merged),
+            "candidates": candidates,
+        })
+
     # ========== Predict ==========
     elif action == "predict":
-        valid, msg = validate_schema(df, check_target=False)
+        with stage("/upload", "validate"):
+            valid, msg = validate_schema(df, check_target=False)
         if not valid:
             return JSONResponse(status_code=400, content={"status": "error", "message": msg})
 
+        model, imputer, scaler, selector = model_store.get()
         if model is None or imputer is None or scaler is None or selector is None:
             return JSONResponse(status_code=500, content={"status": "error", "message": "Model or preprocessing files not loaded. Train and save them first."})
 
 
         # === Apply training preprocessing ===
-        error_cols = [
-            'koi_period', 'koi_time0bk', 'koi_impact',
-            'koi_duration', 'koi_depth',
-            'koi_prad', 'koi_teq', 'koi_insol',
-            'koi_steff', 'koi_slogg', 'koi_srad',
-        ]
-        for col in error_cols:
-            err1 = df.get(col + "_err1", pd.Series(0, index=df.index)).fillna(0)
-            err2 = df.get(col + "_err2", pd.Series(0, index=df.index)).fillna(0)
-            df[col] = df[col].fillna(0) + (err1 + err2) / 2
-
-        drop_cols = [
-            "kepid", "kepoi_name", "kepler_name",
-            "koi_pdisposition", "koi_score", "koi_tce_delivname",
-            "koi_period_err1","koi_period_err2","koi_time0bk_err1","koi_time0bk_err2",
-            "koi_impact_err1","koi_impact_err2","koi_depth_err1","koi_depth_err2",
-            "koi_prad_err1","koi_prad_err2","koi_teq_err1","koi_teq_err2",
-            "koi_steff_err1","koi_steff_err2","koi_slogg_err1","koi_slogg_err2",
-            "koi_srad_err1","koi_srad_err2","koi_duration_err1","koi_duration_err2",
-            "koi_insol_err1","koi_insol_err2"
-        ]
-        df_processed = df.drop(columns=[c for c in drop_cols if c in df.columns], errors="ignore")
-
-        # Apply pipeline
-        X_imp = imputer.transform(df_processed)
-        X_scaled = scaler.transform(X_imp)
-        X_selected = selector.transform(X_scaled)
-
-        preds = model.predict(X_selected)
-        label_map = {1: "CONFIRMED", 0: "FALSE POSITIVE", 2: "CANDIDATE"}
-        df["prediction"] = [label_map.get(p, "UNKNOWN") for p in preds]
-
-        save_cols = ["kepid", "prediction"] if "kepid" in df.columns else ["prediction"]
-        df[save_cols].to_csv(
-            RESULTS_FILE, mode="w", header=not os.path.exists(RESULTS_FILE), index=False
-        )
+        with stage("/upload", "preprocess"):
+            error_cols = [
+                'koi_period', 'koi_time0bk', 'koi_impact',
+                'koi_duration', 'koi_depth',
+                'koi_prad', 'koi_teq', 'koi_insol',
+                'koi_steff', 'koi_slogg', 'koi_srad',
+            ]
+            for col in error_cols:
+                err1 = df.get(col + "_err1", pd.Series(0, index=df.index)).fillna(0)
+                err2 = df.get(col + "_err2", pd.Series(0, index=df.index)).fillna(0)
+                df[col] = df[col].fillna(0) + (err1 + err2) / 2
+
+            drop_cols = [
+                "kepid", "kepoi_name", "kepler_name",
+                "koi_pdisposition", "koi_score", "koi_tce_delivname",
+                "koi_period_err1","koi_period_err2","koi_time0bk_err1","koi_time0bk_err2",
+                "koi_impact_err1","koi_impact_err2","koi_depth_err1","koi_depth_err2",
+                "koi_prad_err1","koi_prad_err2","koi_teq_err1","koi_teq_err2",
+                "koi_steff_err1","koi_steff_err2","koi_slogg_err1","koi_slogg_err2",
+                "koi_srad_err1","koi_srad_err2","koi_duration_err1","koi_duration_err2",
+                "koi_insol_err1","koi_insol_err2"
+            ]
+            df_processed = df.drop(columns=[c for c in drop_cols if c in df.columns], errors="ignore")
+
+            # Apply pipeline
+            X_imp = imputer.transform(df_processed)
+            X_scaled = scaler.transform(X_imp)
+            X_selected = selector.transform(X_scaled)
+
+        with stage("/upload", "predict"):
+            preds = model.predict(X_selected)
+        ROWS.observe(len(preds), "/upload", "predicted")
+
+        with stage("/upload", "serialize"):
+            label_map = {1: "CONFIRMED", 0: "FALSE POSITIVE", 2: "CANDIDATE"}
+            df["prediction"] = [label_map.get(p, "UNKNOWN") for p in preds]
+
+            save_cols = ["kepid", "prediction"] if "kepid" in df.columns else ["prediction"]
+            records = df[save_cols].to_dict(orient="records")
+
+        with stage("/upload", "persist"):
+            df[save_cols].to_csv(
+                RESULTS_FILE, mode="w", header=not os.path.exists(RESULTS_FILE), index=False
+            )
 
         return JSONResponse(status_code=200, content={
             "status": "success",
             "message": "Predictions generated successfully.",
             "rows_uploaded": len(df),
-            "predictions": df[save_cols].to_dict(orient="records")
+            "predictions": records
         })
 
     else:
@@ -406,14 +521,16 @@ def get_dataset(num_rows: int = Query(default=None, ge=1, description="Number of
         raise HTTPException(status_code=404, detail="CSV file not found")
 
     try:
-        df = pd.read_csv(ORIGINAL_DATASET_PATH)
-        df = df[COLUMNS_TO_INCLUDE]
+        with stage("/dataset", "load"):
+            df = pd.read_csv(ORIGINAL_DATASET_PATH)
+            df = df[COLUMNS_TO_INCLUDE]
 
         # =============================
         # ===== Handle Null Values =====
         # =============================
-        numeric_cols = df.select_dtypes(include=["float64", "int64"]).columns
-        df[numeric_cols] = df[numeric_cols].fillna(0)
+        with stage("/dataset", "fill_nulls"):
+            numeric_cols = df.select_dtypes(include=["float64", "int64"]).columns
+            df[numeric_cols] = df[numeric_cols].fillna(0)
 
         # =============================
         # ====== Remove Outliers =======
@@ -428,7 +545,8 @@ def get_dataset(num_rows: int = Query(default=None, ge=1, description="Number of
                 dataframe = dataframe[(dataframe[col] >= lower_bound) & (dataframe[col] <= upper_bound)]
             return dataframe
 
-        df = remove_outliers_iqr(df, numeric_cols)
+        with stage("/dataset", "remove_outliers"):
+            df = remove_outliers_iqr(df, numeric_cols)
 
         # =============================
         # ===== Limit Rows if Any ======
@@ -436,8 +554,111 @@ def get_dataset(num_rows: int = Query(default=None, ge=1, description="Number of
         if num_rows is not None and num_rows < len(df):
             df = df.head(num_rows)
 
-        data = df.to_dict(orient="records")
+        with stage("/dataset", "serialize"):
+            data = df.to_dict(orient="records")
+        ROWS.observe(len(data), "/dataset", "returned")
         return {"data": data, "rows": len(data)}
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+# =============================
+# ========== SKY SEARCH =======
+# =============================
+# Spatial index over ra/dec, rebuilt only when the dataset file changes
+sky_index = SkyIndex(ORIGINAL_DATASET_PATH)
+
+@app.get("/dataset/cone")
+def cone_search(
+    ra: float = Query(..., ge=0, lt=360, description="Right ascension of the cone centre (degrees)"),
+    dec: float = Query(..., ge=-90, le=90, description="Declination of the cone centre (degrees)"),
+    radius: float = Query(..., gt=0, le=180, description="Cone radius (degrees)"),
+    limit: int = Query(default=None, ge=1, description="Maximum number of objects to return"),
+):
+    """
+    Objects within an angular radius of a sky position, nearest first.
+    """
+    if not os.path.exists(sky_index.csv_path):
+        raise HTTPException(status_code=404, detail="CSV file not found")
+
+    with stage("/dataset/cone", "query"):
+        data = sky_index.cone(ra, dec, radius, limit)
+    ROWS.observe(len(data), "/dataset/cone", "returned")
+    return {"data": data, "rows": len(data)}
+
+@app.get("/dataset/nearest")
+def nearest_search(
+    ra: float = Query(..., ge=0, lt=360, description="Right ascension (degrees)"),
+    dec: float = Query(..., ge=-90, le=90, description="Declination (degrees)"),
+    k: int = Query(default=10, ge=1, le=1000, description="Number of neighbours"),
+):
+    """
+    The k objects closest to a sky position, nearest first.
+    """
+    if not os.path.exists(sky_index.csv_path):
+        raise HTTPException(status_code=404, detail="CSV file not found")
+
+    with stage("/dataset/nearest", "query"):
+        data = sky_index.nearest(ra, dec, k)
+    ROWS.observe(len(data), "/dataset/nearest", "returned")
+    return {"data": data, "rows": len(data)}
+
+# =============================
+# ========== SIMILAR PLANETS ==
+# =============================
+# KD-tree over the model's feature space, rebuilt when a new model is promoted
+similarity_index = SimilarityIndex(ORIGINAL_DATASET_PATH, model_store)
+
+class SimilarRowsRequest(BaseModel):
+    rows: list[dict]
+    k: int = Field(default=5, ge=1, le=100)
+
+@app.get("/similar/{kepid}")
+def similar_to_kepid(kepid: int, k: int = Query(default=5, ge=1, le=100, description="Number of similar objects")):
+    """
+    The k known objects most similar to each KOI of a star, with their dispositions.
+    """
+    if not os.path.exists(similarity_index.csv_path):
+        raise HTTPException(status_code=404, detail="CSV file not found")
+    if not model_store.ready:
+        raise HTTPException(status_code=500, detail="Model or preprocessing files not loaded. Train and save them first.")
+
+    with stage("/similar/{kepid}", "query"):
+        results = similarity_index.similar_to_kepid(kepid, k)
+    if results is None:
+        raise HTTPException(status_code=404, detail=f"No object found for kepid {kepid}.")
+    return {"kepid": kepid, "results": results}
+
+@app.post("/similar")
+def similar_to_rows(request: SimilarRowsRequest):
+    """
+    The k known objects most similar to each raw feature row (EXPECTED_SCHEMA columns; missing ones are imputed).
+    """
+    if not request.rows:
+        raise HTTPException(status_code=400, detail="No rows provided.")
+    if not os.path.exists(similarity_index.csv_path):
+        raise HTTPException(status_code=404, detail="CSV file not found")
+    if not model_store.ready:
+        raise HTTPException(status_code=500, detail="Model or preprocessing files not loaded. Train and save them first.")
+
+    df = pd.DataFrame(request.rows)
+    unknown = set(df.columns) - set(EXPECTED_SCHEMA.keys())
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown columns: {sorted(unknown)}")
+
+    # Numeric features must parse as numbers; nulls are left for the imputer
+    for col in df.columns:
+        if EXPECTED_SCHEMA[col] == "object":
+            continue
+        try:
+            values = pd.to_numeric(df[col], errors="coerce")
+        except (TypeError, ValueError):
+            values = None  # nested lists/objects are rejected even with errors="coerce"
+        if values is None or (values.isna() & df[col].notna()).any():
+            raise HTTPException(status_code=400, detail=f"Non-numeric value in column {col}")
+        df[col] = values
+
+    with stage("/similar", "query"):
+        results = similarity_index.similar_to_rows(df, request.k)
+    ROWS.observe(len(df), "/similar", "queried")
+    return {"results": results, "rows": len(results)}
@@ -0,0 +1,302 @@
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# =============================
+# Multi-process mode
+# =============================
+# With several uvicorn workers each process has its own registry. When this
+# directory is set, every worker periodically writes its series to
+# metrics-<pid>.json there and /metrics sums all files, so a scrape sees the
+# whole service whichever worker answers it.
+METRICS_MULTIPROC_DIR = os.environ.get("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 1.0))
+
+
+# =============================
+# Buckets
+# =============================
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+ROW_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+BYTE_BUCKETS = (1_024, 10_240, 102_400, 1_048_576, 10_485_760, 104_857_600, 1_073_741_824)
+INF_LABEL = 'le="+Inf"'
+
+
+# =============================
+# Histogram
+# =============================
+class Histogram:
+    """Cumulative histogram with fixed buckets, labelled by a tuple of label values."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = [0] * len(self.buckets) + [0.0, 0]
+                self._series[labels] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    @staticmethod
+    def merge(total: dict, labels: tuple, series: list):
+        if labels in total:
+            total[labels] = [a + b for a, b in zip(total[labels], series)]
+        else:
+            total[labels] = list(series)
+
+    def render(self, series_by_labels: dict = None) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        if series_by_labels is None:
+            series_by_labels = self.snapshot()
+        for labels, series in series_by_labels.items():
+            base = _format_labels(self.label_names, labels)
+            for bound, count in zip(self.buckets, series):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{{{_join(base, le)}}} {count}")
+            lines.append(f"{self.name}_bucket{{{_join(base, INF_LABEL)}}} {series[-1]}")
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}_sum{suffix} {series[-2]}")
+            lines.append(f"{self.name}_count{suffix} {series[-1]}")
+        return lines
+
+
+# =============================
+# Counter
+# =============================
+class Counter:
+    """Monotonic counter labelled by a tuple of label values."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._series)
+
+    @staticmethod
+    def merge(total: dict, labels: tuple, value: float):
+        total[labels] = total.get(labels, 0) + value
+
+    def render(self, series_by_labels: dict = None) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        if series_by_labels is None:
+            series_by_labels = self.snapshot()
+        for labels, value in series_by_labels.items():
+            base = _format_labels(self.label_names, labels)
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}{suffix} {value}")
+        return lines
+
+
+# =============================
+# Gauge
+# =============================
+class Gauge:
+    """Last-set value labelled by a tuple of label values."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}  # labels -> [value, time set]
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._series[labels] = [value, time.time()]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    @staticmethod
+    def merge(total: dict, labels: tuple, series: list):
+        # Across workers the most recently set value wins
+        if labels not in total or series[1] > total[labels][1]:
+            total[labels] = list(series)
+
+    def render(self, series_by_labels: dict = None) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        if series_by_labels is None:
+            series_by_labels = self.snapshot()
+        for labels, (value, _) in series_by_labels.items():
+            base = _format_labels(self.label_names, labels)
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}{suffix} {value}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _join(base: str, extra: str) -> str:
+    return f"{base},{extra}" if base else extra
+
+
+# =============================
+# Registry
+# =============================
+REQUEST_LATENCY = Histogram(
+    "upload_service_request_duration_seconds",
+    "HTTP request latency by endpoint.",
+    ("method", "endpoint", "status"),
+    LATENCY_BUCKETS,
+)
+REQUESTS_TOTAL = Counter(
+    "upload_service_requests_total",
+    "HTTP requests by endpoint.",
+    ("method", "endpoint", "status"),
+)
+STAGE_LATENCY = Histogram(
+    "upload_service_stage_duration_seconds",
+    "Latency of internal processing stages.",
+    ("endpoint", "stage"),
+    LATENCY_BUCKETS,
+)
+MODEL_FIT_LATENCY = Histogram(
+    "upload_service_model_fit_duration_seconds",
+    "Fit time of each candidate model during retraining.",
+    ("model",),
+    LATENCY_BUCKETS,
+)
+MODEL_SCORE = Gauge(
+    "upload_service_model_score",
+    "Held-out score of each candidate model in the most recent retrain that trained it.",
+    ("model", "metric"),
+)
+ROWS = Histogram(
+    "upload_service_rows",
+    "Number of rows handled per request.",
+    ("endpoint", "kind"),
+    ROW_BUCKETS,
+)
+PAYLOAD_BYTES = Histogram(
+    "upload_service_payload_bytes",
+    "Size of request and response payloads.",
+    ("endpoint", "direction"),
+    BYTE_BUCKETS,
+)
+
+REGISTRY = [REQUEST_LATENCY, REQUESTS_TOTAL, STAGE_LATENCY, MODEL_FIT_LATENCY, MODEL_SCORE, ROWS, PAYLOAD_BYTES]
+
+
+# =============================
+# Helpers
+# =============================
+@contextmanager
+def stage(endpoint: str, name: str):
+    """Time a block of code as one stage of an endpoint."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, endpoint, name)
+
+
+def record_model_fit(name: str, seconds: float, accuracy: float = None, f1: float = None):
+    """Callback for train_and_save_model: record each candidate's fit time and scores."""
+    MODEL_FIT_LATENCY.observe(seconds, name)
+    if accuracy is not None:
+        MODEL_SCORE.set(accuracy, name, "accuracy")
+    if f1 is not None:
+        MODEL_SCORE.set(f1, name, "f1_weighted")
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _write_worker_file():
+    data = {
+        metric.name: [[list(labels), series] for labels, series in metric.snapshot().items()]
+        for metric in REGISTRY
+    }
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    path = os.path.join(METRICS_MULTIPROC_DIR, f"metrics-{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            _write_worker_file()
+        except OSError as e:
+            print("⚠️ Warning: Could not write metrics file.", str(e))
+
+
+def start_flusher():
+    """In multi-process mode, write this worker's series to its file every METRICS_FLUSH_INTERVAL."""
+    global _flusher
+    if not METRICS_MULTIPROC_DIR or _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="metrics-flusher", daemon=True)
+            _flusher.start()
+
+
+def _aggregate() -> dict:
+    """Sum the series of every worker file, including workers that have exited (counters never go down)."""
+    totals = {metric.name: {} for metric in REGISTRY}
+    merges = {metric.name: metric.merge for metric in REGISTRY}
+    for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, "metrics-*.json")):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, items in data.items():
+            if name not in totals:
+                continue
+            for labels, series in items:
+                merges[name](totals[name], tuple(labels), series)
+    return totals
+
+
+def render_prometheus() -> str:
+    """Render every registered metric in Prometheus text exposition format."""
+    totals = None
+    if METRICS_MULTIPROC_DIR:
+        _write_worker_file()
+        totals = _aggregate()
+
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(totals[metric.name] if totals is not None else None))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import joblib
+
+
+# =============================
+# Settings
+# =============================
+# "r" memory-maps the numpy arrays inside each artifact, so workers share
+# their pages instead of each holding a copy. Tree ensembles are served from
+# best_model_flat.pkl (plain arrays, see flat_trees.py) because sklearn's own
+# tree objects copy their nodes into private memory when unpickled.
+MODEL_MMAP_MODE = os.environ.get("MODEL_MMAP_MODE", "r") or None
+# How often (seconds) a worker checks whether a new model was promoted
+MODEL_CHECK_INTERVAL = float(os.environ.get("MODEL_CHECK_INTERVAL", 2.0))
+
+VERSION_FILE = "VERSION"
+ARTIFACTS = {
+    "model": "best_model.pkl",
+    "imputer": "imputer.pkl",
+    "scaler": "scaler.pkl",
+    "selector": "selector.pkl",
+}
+# Written by train_and_save_model for Random Forest / Gradient Boosting winners
+FLAT_MODEL = "best_model_flat.pkl"
+
+
+# =============================
+# Model store
+# =============================
+class ModelStore:
+    """
+    Holds the trained model and preprocessing objects for one worker process.
+
+    Artifacts are memory-mapped (see MODEL_MMAP_MODE), so N uvicorn workers
+    share one copy of the model arrays. A directory written before flat
+    exports existed has no best_model_flat.pkl; a tree ensemble in it is
+    loaded per worker until the next retrain.
+
+    Promotion is signalled through a VERSION file in the model directory:
+    whichever worker retrains calls promote(), and every worker (including
+    itself) reloads the next time it notices the file changed. VERSION is a
+    manifest of the exact files (size, mtime) of the promoted model;
+    a set of files that does not match it, e.g. while a retrain is still
+    replacing them one by one, is not loaded.
+    """
+
+    def __init__(self, model_dir: str, mmap_mode=MODEL_MMAP_MODE,
+                 check_interval: float = MODEL_CHECK_INTERVAL):
+        self.model_dir = model_dir
+        self.mmap_mode = mmap_mode
+        self.check_interval = check_interval
+
+        self.model = None
+        self.imputer = None
+        self.scaler = None
+        self.selector = None
+        self.version = None
+
+        self._loaded_marker = None
+        self._mismatch_warned = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    # ----- Loading -----
+    def load(self):
+        """
+        (Re)load every artifact. Keeps the previous objects if loading fails,
+        and retries on the next check if the files do not match VERSION.
+        """
+        marker = self._read_marker()
+        files = dict(ARTIFACTS)
+        if marker is not None:
+            if FLAT_MODEL in marker["files"]:
+                files["model"] = FLAT_MODEL
+        elif os.path.exists(os.path.join(self.model_dir, FLAT_MODEL)):
+            files["model"] = FLAT_MODEL
+
+        # Without a VERSION, at least make sure no file is replaced while loading
+        expected = marker["files"] if marker is not None else {f: self._file_id(f) for f in files.values()}
+        if not self._matches(expected, files):
+            if marker != self._mismatch_warned:
+                print("⚠️ Warning: Model files do not match VERSION (retrain in progress?); will retry.")
+                self._mismatch_warned = marker
+            return False
+        try:
+            loaded = {
+                name: joblib.load(os.path.join(self.model_dir, filename), mmap_mode=self.mmap_mode)
+                for name, filename in files.items()
+            }
+        except Exception as e:
+            print("⚠️ Warning: Could not load model or preprocessing files.", str(e))
+            self._loaded_marker = marker
+            return False
+        # A file replaced while loading would also change its mtime
+        if not self._matches(expected, files):
+            print("⚠️ Warning: Model files changed while loading; will retry.")
+            return False
+
+        self.model = loaded["model"]
+        self.imputer = loaded["imputer"]
+        self.scaler = loaded["scaler"]
+        self.selector = loaded["selector"]
+        self.version = marker["version"] if marker else "initial"
+        self._loaded_marker = marker
+        print(f"✅ Loaded trained model and preprocessing objects (version {self.version}).")
+        return True
+
+    def get(self):
+        """Return (model, imputer, scaler, selector), reloading first if a new model was promoted."""
+        now = time.monotonic()
+        if now >= self._next_check:
+            with self._lock:
+                if now >= self._next_check:
+                    self._next_check = now + self.check_interval
+                    if self._read_marker() != self._loaded_marker:
+                        self.load()
+        return self.model, self.imputer, self.scaler, self.selector
+
+    @property
+    def ready(self) -> bool:
+        return None not in (self.model, self.imputer, self.scaler, self.selector)
+
+    # ----- Promotion -----
+    def promote(self) -> str:
+        """Mark the artifacts currently on disk as the new model for all workers."""
+        version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        files = {}
+        for filename in [*ARTIFACTS.values(), FLAT_MODEL]:
+            file_id = self._file_id(filename)
+            if file_id is not None:
+                files[filename] = file_id
+
+        path = os.path.join(self.model_dir, VERSION_FILE)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": version, "files": files}, f)
+        os.replace(tmp_path, path)
+
+        # Reload in this worker straight away; the others follow within check_interval
+        with self._lock:
+            self._next_check = 0.0
+        self.get()
+        return version
+
+    def _file_id(self, filename: str):
+        try:
+            stat = os.stat(os.path.join(self.model_dir, filename))
+        except OSError:
+            return None
+        # No inode: copies made with shutil.copytree/copy2 must still match
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _matches(self, expected: dict, files: dict) -> bool:
+        """True if every file to load still has the size/mtime recorded in `expected`."""
+        return all(self._file_id(filename) == expected.get(filename) for filename in files.values())
+
+    def _read_marker(self):
+        """The VERSION manifest, or None if the directory has never been promoted."""
+        path = os.path.join(self.model_dir, VERSION_FILE)
+        try:
+            with open(path) as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return marker if isinstance(marker, dict) and "files" in marker else None
@@ -0,0 +1,279 @@
+import glob
+import hmac
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, OrderedDict
+
+
+# =============================
+# Settings (read once at startup)
+# =============================
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+PROFILE_SAMPLE_EVERY = int(os.environ.get("PROFILE_SAMPLE_EVERY", 0))  # profile 1 in N requests, 0 = never
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.001))    # seconds between stack samples
+PROFILE_MAX_STORED = int(os.environ.get("PROFILE_MAX_STORED", 50))
+PROFILE_ADMIN_TOKEN = os.environ.get("PROFILE_ADMIN_TOKEN", "")
+# Shared directory for profiles when running several worker processes;
+# unset keeps them in this process's memory
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "")
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_QUERY_PARAM = "profile"
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+TOP_STACKS = 50
+TOP_ALLOCATIONS = 20
+
+# Leaf frames of threads that are parked rather than working (idle pool
+# workers, the event loop waiting for I/O, ...). Stacks ending in one of
+# these are counted as idle and left out of the report. Services add their
+# own background loops with add_idle_frame().
+IDLE_LEAF_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("socket.py", "accept"),
+    ("socketserver.py", "serve_forever"),
+    ("queue.py", "get"),
+    ("_base.py", "result"),
+}
+
+
+def add_idle_frame(filename: str, func: str):
+    """Treat stacks ending in `func` of `filename` (basename) as idle."""
+    IDLE_LEAF_FRAMES.add((filename, func))
+
+
+# =============================
+# Sampling profiler
+# =============================
+class StackSampler:
+    """
+    Wall-clock sampling profiler built on sys._current_frames().
+    A background thread records the stack of every other thread each
+    `interval` seconds; stacks are kept in folded form
+    ("file:func:line;file:func:line") so they can be fed to flamegraph tools.
+
+    Without `thread_ids` every thread is sampled, so work done for other
+    concurrent requests shows up too; parked threads are skipped.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, thread_ids=None):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if self.thread_ids is not None and thread_id not in self.thread_ids:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAF_FRAMES:
+                    self.idle_samples += 1
+                    continue
+                self.stacks[_fold(frame)] += 1
+                self.samples += 1
+
+
+def _fold(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+# =============================
+# One profiled request
+# =============================
+class RequestProfile:
+    """Sampling profile plus tracemalloc allocation stats for a single request."""
+
+    def __init__(self, method: str, path: str, thread_ids=None):
+        self.method = method
+        self.path = path
+        self.sampler = StackSampler(thread_ids=thread_ids)
+        self._owns_tracemalloc = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._started_at = time.time()
+        self._start = time.perf_counter()
+        self.sampler.start()
+
+    def stop(self, status) -> dict:
+        duration = time.perf_counter() - self._start
+        self.sampler.stop()
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+
+        allocations = [
+            {"location": str(stat.traceback), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+        ]
+        samples = self.sampler.samples
+        stacks = [
+            {"stack": stack, "samples": count, "share": round(count / samples, 4)}
+            for stack, count in self.sampler.stacks.most_common(TOP_STACKS)
+        ]
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "started_at": self._started_at,
+            "duration_ms": round(duration * 1000, 2),
+            "samples": samples,
+            "idle_samples": self.sampler.idle_samples,
+            "interval_ms": self.sampler.interval * 1000,
+            "stacks": stacks,
+            "memory": {
+                "traced_current_kb": round(current / 1024, 1),
+                "traced_peak_kb": round(peak / 1024, 1),
+                "top_allocations": allocations,
+            },
+        }
+
+
+# =============================
+# Selection + storage
+# =============================
+_request_counter = itertools.count(1)
+# Only one request is profiled at a time: tracemalloc and the sampler are process-wide
+_profile_slot = threading.Lock()
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+
+
+def should_profile(header_value, query_value, admin_token=None) -> bool:
+    """
+    Decide whether a request is profiled. The header / query flag only count
+    with a valid admin token: a profile turns on process-wide tracemalloc,
+    which slows every concurrent request. 1-in-N sampling needs no token.
+    """
+    if (header_value in ("1", "true") or query_value in ("1", "true")) and admin_authorized(admin_token):
+        return True
+    return PROFILE_SAMPLE_EVERY > 0 and next(_request_counter) % PROFILE_SAMPLE_EVERY == 0
+
+
+def begin_profile(method: str, path: str, thread_ids=None):
+    """Start profiling a request, or return None if another request is already being profiled."""
+    if not _profile_slot.acquire(blocking=False):
+        return None
+    profile = RequestProfile(method, path, thread_ids=thread_ids)
+    try:
+        profile.start()
+    except Exception:
+        _profile_slot.release()
+        raise
+    return profile
+
+
+def end_profile(profile: RequestProfile, status) -> str:
+    """Stop a running profile, store the result and return its id."""
+    try:
+        result = profile.stop(status)
+    finally:
+        _profile_slot.release()
+
+    profile_id = uuid.uuid4().hex[:12]
+    result["id"] = profile_id
+    if PROFILE_DIR:
+        _store_file(profile_id, result)
+        return profile_id
+    with _profiles_lock:
+        _profiles[profile_id] = result
+        while len(_profiles) > PROFILE_MAX_STORED:
+            _profiles.popitem(last=False)
+    return profile_id
+
+
+def _store_file(profile_id: str, result: dict):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(result, f)
+    os.replace(f"{path}.tmp", path)
+
+    # Keep the newest PROFILE_MAX_STORED across all workers
+    paths = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")), key=_mtime)
+    for old in paths[:-PROFILE_MAX_STORED]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def _load_file(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+SUMMARY_KEYS = ("id", "method", "path", "status", "started_at", "duration_ms", "samples")
+
+
+def list_profiles() -> list[dict]:
+    if PROFILE_DIR:
+        paths = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")), key=_mtime, reverse=True)
+        profiles = [p for p in map(_load_file, paths) if p is not None]
+    else:
+        with _profiles_lock:
+            profiles = list(reversed(_profiles.values()))
+    return [{k: p[k] for k in SUMMARY_KEYS} for p in profiles]
+
+
+def get_profile(profile_id: str):
+    if PROFILE_DIR:
+        # Ids are generated hex strings; anything else cannot name a stored profile
+        if not all(c in "0123456789abcdef" for c in profile_id):
+            return None
+        return _load_file(os.path.join(PROFILE_DIR, f"{profile_id}.json"))
+    with _profiles_lock:
+        return _profiles.get(profile_id)
+
+
+def admin_authorized(token) -> bool:
+    """Admin endpoints are disabled unless PROFILE_ADMIN_TOKEN is set."""
+    if not PROFILE_ADMIN_TOKEN or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode())
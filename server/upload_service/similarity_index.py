@@ -0,0 +1,96 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+from server.models.notebook.KOI import transform_features
+
+
+# Columns returned for every similar object
+SIMILAR_COLUMNS = ["kepid", "kepoi_name", "kepler_name", "koi_disposition"]
+
+
+# =============================
+# Similarity index
+# =============================
+class SimilarityIndex:
+    """
+    KD-tree over the catalogue in the model's feature space
+    (imputer -> scaler -> selector), so "similar planets" is a tree query
+    instead of a table scan.
+
+    The tree is rebuilt when either the promoted model version (the
+    transformers define the space) or the dataset CSV changes.
+    """
+
+    def __init__(self, csv_path: str, model_store):
+        self.csv_path = csv_path
+        self.model_store = model_store
+        self._version = None
+        self._state = None  # (tree, X, rows, transformers), swapped together on rebuild
+        self._lock = threading.Lock()
+
+    def _ensure_built(self):
+        # get() also picks up a newly promoted model before the version is read
+        _, imputer, scaler, selector = self.model_store.get()
+        stat = os.stat(self.csv_path)
+        version = (self.model_store.version, stat.st_mtime_ns, stat.st_size)
+        if version == self._version:
+            return self._state
+        with self._lock:
+            if version == self._version:
+                return self._state
+            df = pd.read_csv(self.csv_path)
+            # Uploads append rows, so an object can appear more than once; keep its latest row
+            if "kepoi_name" in df.columns:
+                df = df.drop_duplicates(subset="kepoi_name", keep="last")
+            df = df.reset_index(drop=True)
+            X = transform_features(df, imputer, scaler, selector)
+            rows = df[[c for c in SIMILAR_COLUMNS if c in df.columns]]
+            self._state = (KDTree(X), X, rows, (imputer, scaler, selector))
+            self._version = version
+            print(f"✅ Built similarity index over {len(rows)} objects.")
+            return self._state
+
+    def refresh(self):
+        """Rebuild now (if stale) instead of on the next query."""
+        self._ensure_built()
+
+    @staticmethod
+    def _records(rows: pd.DataFrame, indices, distances) -> list[dict]:
+        matches = rows.iloc[indices].copy()
+        matches["distance"] = distances
+        matches = matches.astype(object).where(matches.notna(), None)
+        return matches.to_dict(orient="records")
+
+    def similar_to_kepid(self, kepid: int, k: int):
+        """
+        For every KOI of star `kepid`, the k most similar other objects.
+        Returns None if the kepid is not in the catalogue.
+        """
+        tree, X, rows, _ = self._ensure_built()
+        positions = np.flatnonzero(rows["kepid"].to_numpy() == kepid)
+        if len(positions) == 0:
+            return None
+
+        # Query k+1 so the object itself can be dropped from its own results
+        distances, indices = tree.query(X[positions], k=min(k + 1, len(rows)))
+        names = rows["kepoi_name"].to_numpy() if "kepoi_name" in rows.columns else None
+
+        results = []
+        for pos, dist_row, idx_row in zip(positions, distances, indices):
+            keep = idx_row != pos if names is None else names[idx_row] != names[pos]
+            query = rows.iloc[[pos]]
+            query = query.astype(object).where(query.notna(), None).to_dict(orient="records")[0]
+            query["similar"] = self._records(rows, idx_row[keep][:k], dist_row[keep][:k])
+            results.append(query)
+        return results
+
+    def similar_to_rows(self, data: pd.DataFrame, k: int) -> list[list[dict]]:
+        """The k most similar known objects for each raw feature row."""
+        tree, _, rows, (imputer, scaler, selector) = self._ensure_built()
+        X = transform_features(data, imputer, scaler, selector)
+        distances, indices = tree.query(X, k=min(k, len(rows)))
+        return [self._records(rows, idx_row, dist_row) for dist_row, idx_row in zip(distances, indices)]
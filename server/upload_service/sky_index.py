@@ -0,0 +1,75 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+
+# Columns returned for every matched object
+SKY_COLUMNS = ["kepid", "kepoi_name", "kepler_name", "koi_disposition", "ra", "dec"]
+
+
+# =============================
+# Sky index
+# =============================
+class SkyIndex:
+    """
+    BallTree over (dec, ra) with the haversine metric, built from the dataset CSV.
+
+    The tree is rebuilt only when the CSV changes (mtime/size), so each cone
+    or nearest-neighbour query costs O(log n) instead of a table scan.
+    """
+
+    def __init__(self, csv_path: str):
+        self.csv_path = csv_path
+        self._version = None
+        self._state = None  # (tree, rows), swapped together on rebuild
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        stat = os.stat(self.csv_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _ensure_built(self):
+        version = self._current_version()
+        if version == self._version:
+            return self._state
+        with self._lock:
+            if version == self._version:
+                return self._state
+            df = pd.read_csv(self.csv_path, usecols=lambda c: c in SKY_COLUMNS)
+            df = df.dropna(subset=["ra", "dec"]).reset_index(drop=True)
+            coords = np.radians(df[["dec", "ra"]].to_numpy())
+            self._state = (BallTree(coords, metric="haversine"), df)
+            self._version = version
+            print(f"✅ Built sky index over {len(df)} objects.")
+            return self._state
+
+    @staticmethod
+    def _records(rows: pd.DataFrame, indices, distances) -> list[dict]:
+        rows = rows.iloc[indices].copy()
+        rows["separation_deg"] = np.degrees(distances)
+        # NaN is not valid JSON (e.g. kepler_name for unconfirmed objects)
+        rows = rows.astype(object).where(rows.notna(), None)
+        return rows.to_dict(orient="records")
+
+    def cone(self, ra: float, dec: float, radius_deg: float, limit: int = None) -> list[dict]:
+        """Objects within radius_deg of (ra, dec), nearest first."""
+        tree, rows = self._ensure_built()
+        indices, distances = tree.query_radius(
+            np.radians([[dec, ra]]), r=np.radians(radius_deg), return_distance=True, sort_results=True
+        )
+        indices, distances = indices[0], distances[0]
+        if limit is not None:
+            indices, distances = indices[:limit], distances[:limit]
+        return self._records(rows, indices, distances)
+
+    def nearest(self, ra: float, dec: float, k: int) -> list[dict]:
+        """The k objects closest to (ra, dec), nearest first."""
+        tree, rows = self._ensure_built()
+        k = min(k, len(rows))
+        if k == 0:
+            return []
+        distances, indices = tree.query(np.radians([[dec, ra]]), k=k)
+        return self._records(rows, indices[0], distances[0])